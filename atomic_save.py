@@ -0,0 +1,21 @@
+import os
+import threading
+from PIL import Image
+
+
+def save_atomic(image, path, **params):
+    """先写入同一目录的临时文件再替换，中途崩溃、取消或并发读取都不会看到半个文件
+
+    临时文件用普通的 open() 创建（按 umask 设置权限，与直接保存相同），
+    文件名带进程号和线程号，并发写入互不干扰。格式由扩展名决定。
+    """
+    image_format = Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            image.save(f, image_format, **params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+import logging
+from renderer import list_avatars
+
+# 排版记录文件名，保存在输出文件夹中
+JOURNAL_NAME = 'batch_journal.jsonl'
+
+
+def digest(value):
+    """对可转为 JSON 的值计算摘要"""
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_state(path):
+    """文件的路径、修改时间和大小，文件不存在时为 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class BatchJournal:
+    """批量生成的排版记录（输出文件夹中只追加的 JSON Lines），用于跳过已完成的画布"""
+
+    def __init__(self, output_folder):
+        self.path = os.path.join(output_folder, JOURNAL_NAME)
+        self.entries = {}  # 画布名称 -> 最后一条记录
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logging.warning(f"读取排版记录 {self.path} 时出错: {e}")
+            return
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                self.entries[entry['sheet']] = entry
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    @staticmethod
+    def job_hashes(job):
+        """返回任务的 (设置摘要, 头像摘要)，与输出无关的并行参数和缓存目录不参与计算"""
+        settings_hash = digest([job['settings'], job['fonts'], file_state(job['background_path'])])
+
+        avatars = list_avatars(job['class_path']) if os.path.isdir(job['class_path']) else []
+        if job.get('avatar_range'):
+            start, end = job['avatar_range']
+            avatars = avatars[start:end]
+        plan = job.get('plan')
+        avatars_hash = digest([[file_state(path) for _, path in avatars],
+                               plan.to_dict() if plan else None, job.get('plan_error')])
+        return settings_hash, avatars_hash
+
+    def is_done(self, job):
+        """画布已按相同的设置和头像生成，且输出文件仍然存在"""
+        entry = self.entries.get(job.get('sheet_name', job['class_name']))
+        if entry is None or not os.path.exists(job['output_path']):
+            return False
+        return [entry.get('settings_hash'), entry.get('avatars_hash')] == list(self.job_hashes(job))
+
+    def pending_jobs(self, jobs):
+        """过滤掉已完成的画布，返回 (待生成的任务, 跳过的画布数)"""
+        pending = [job for job in jobs if not self.is_done(job)]
+        return pending, len(jobs) - len(pending)
+
+    def record(self, job, output_path):
+        """追加一条完成记录并立即写入磁盘"""
+        settings_hash, avatars_hash = self.job_hashes(job)
+        entry = {
+            'sheet': job.get('sheet_name', job['class_name']),
+            'output': os.path.basename(output_path),
+            'settings_hash': settings_hash,
+            'avatars_hash': avatars_hash
+        }
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logging.warning(f"写入排版记录 {self.path} 时出错: {e}")
+            return
+        self.entries[entry['sheet']] = entry
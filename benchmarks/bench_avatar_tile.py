@@ -0,0 +1,109 @@
+"""头像处理基准测试：比较旧的"裁剪 → 缩放 → RGBA → 再缩放到边框内"流程与单次重采样流程
+
+统计每张头像的耗时，以及 Pillow 分配器记录的新建图像数和内存块分配次数。
+用法: python benchmarks/bench_avatar_tile.py [--source 3024x4032] [--tile 360x450] [--count 20]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from renderer import build_avatar_tile, draft_for_tile
+
+
+def legacy_avatar_tile(avatar_path, size, ratio="4:5", corner_radius=0, border_color=None, border_size=0):
+    """旧版流程：先缩放到整个头像尺寸，有边框时再缩放一次到边框内尺寸"""
+    with Image.open(avatar_path) as img:
+        target_ratio = 4/5 if ratio == "4:5" else 1
+        draft_for_tile(img, size, target_ratio)
+        img = img.convert('RGB')
+
+        if img.width / img.height > target_ratio:
+            new_width = int(img.height * target_ratio)
+            left = (img.width - new_width) // 2
+            img = img.crop((left, 0, left + new_width, img.height))
+        else:
+            new_height = int(img.width / target_ratio)
+            top = (img.height - new_height) // 2
+            img = img.crop((0, top, img.width, top + new_height))
+
+        img = img.resize(size, Image.LANCZOS)
+        img = img.convert('RGBA')
+
+        if corner_radius > 0:
+            mask = Image.new('L', size, 0)
+            ImageDraw.Draw(mask).rounded_rectangle(
+                [0, 0, size[0]-1, size[1]-1], radius=min(size[0], size[1]) * corner_radius, fill=255)
+            img.putalpha(mask)
+
+        if border_color and border_size > 0:
+            result = Image.new('RGBA', size, border_color)
+            if corner_radius > 0:
+                result.putalpha(mask)
+            inner_size = (size[0] - 2*border_size, size[1] - 2*border_size)
+            inner_img = img.resize(inner_size)
+            result.paste(inner_img, (border_size, border_size), inner_img)
+            return result
+        return img
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def make_photo(path, size):
+    """生成带渐变的测试照片（纯色照片的 JPEG 解码过快，不具代表性）"""
+    vertical = Image.linear_gradient('L')
+    horizontal = vertical.transpose(Image.ROTATE_90)
+    channels = [band.resize(size) for band in (vertical, horizontal, vertical.transpose(Image.FLIP_TOP_BOTTOM))]
+    img = Image.merge('RGB', channels)
+    img.save(path, quality=90)
+
+
+def measure(func, path, tile_size, style, count):
+    """返回 (每张耗时 ms, 每张新建的图像数, 每张分配的内存块数)"""
+    func(path, tile_size, *style)  # 预热，排除遮罩缓存等一次性开销
+    before = Image.core.get_stats()
+    start = time.perf_counter()
+    for _ in range(count):
+        func(path, tile_size, *style)
+    elapsed = time.perf_counter() - start
+    after = Image.core.get_stats()
+    images = after['new_count'] - before['new_count']
+    blocks = after['allocated_blocks'] - before['allocated_blocks']
+    return elapsed / count * 1000, images / count, blocks / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--source', type=parse_size, default=(3024, 4032), help='测试照片尺寸')
+    parser.add_argument('--tile', type=parse_size, default=(360, 450), help='头像尺寸')
+    parser.add_argument('--count', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'photo.jpg')
+        make_photo(path, args.source)
+
+        styles = [
+            ('无圆角无边框', ("4:5", 0, None, 0)),
+            ('圆角', ("4:5", 0.1, None, 0)),
+            ('圆角+边框', ("4:5", 0.1, '#ff0000', 4)),
+        ]
+        print(f"源图 {args.source[0]}x{args.source[1]} JPEG, 头像 {args.tile[0]}x{args.tile[1]}, 每项 {args.count} 次")
+        for label, style in styles:
+            old = measure(legacy_avatar_tile, path, args.tile, style, args.count)
+            new = measure(build_avatar_tile, path, args.tile, style, args.count)
+            print(f"{label}:")
+            for name, (ms, images, blocks) in (('旧流程', old), ('新流程', new)):
+                print(f"  {name}: {ms:7.1f} ms/张, 新建图像 {images:4.1f} 个/张, 内存块分配 {blocks:4.1f} 次/张")
+            print(f"  加速比: {old[0] / new[0]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""字体扫描基准测试：在合成字体目录上比较串行与进程池冷扫描耗时
+
+用法: python benchmarks/bench_font_scan.py [--files 1000] [--workers 8]
+依赖: pip install -r benchmarks/requirements.txt（fonttools 仅用于生成合成字体）
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTCollection
+import fonts
+from fonts import FontIndex
+
+
+def build_font(family, glyph_count=200):
+    """构建一个带 name 表和若干简单字形的 TrueType 字体"""
+    glyph_names = ['.notdef'] + [f'g{i}' for i in range(glyph_count)]
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(glyph_names)
+    fb.setupCharacterMap({0x4E00 + i: f'g{i}' for i in range(glyph_count)})
+
+    glyphs = {}
+    for name in glyph_names:
+        pen = TTGlyphPen(None)
+        pen.moveTo((100, 0))
+        pen.lineTo((100, 700))
+        pen.lineTo((800, 700))
+        pen.closePath()
+        glyphs[name] = pen.glyph()
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics({name: (1000, 100) for name in glyph_names})
+    fb.setupHorizontalHeader(ascent=880, descent=-120)
+    fb.setupNameTable({'familyName': family, 'styleName': 'Regular'})
+    # 添加简体中文名称记录 (平台 3, 编码 1, 语言 0x804)
+    fb.font['name'].setName(f'测试字体{family}', 1, 3, 1, 0x804)
+    fb.setupOS2()
+    fb.setupPost()
+    return fb.font
+
+
+def build_font_dir(path, count):
+    """生成 count 个字体文件，其中约十分之一为包含两个字体的 .ttc"""
+    for i in range(count):
+        if i % 10 == 0:
+            collection = TTCollection()
+            collection.fonts = [build_font(f'Bench{i}A'), build_font(f'Bench{i}B')]
+            collection.save(os.path.join(path, f'bench{i}.ttc'))
+        else:
+            build_font(f'Bench{i}').save(os.path.join(path, f'bench{i}.ttf'))
+
+
+def time_scan(font_dir, workers):
+    """冷扫描一次（空数据库）并返回 (耗时, 统计)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        with FontIndex(os.path.join(tmp, 'bench.db')) as index:
+            start = time.perf_counter()
+            stats = index.scan([font_dir], workers=workers)
+            elapsed = time.perf_counter() - start
+            names = len(index.load())
+    return elapsed, stats, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as font_dir:
+        print(f"生成 {args.files} 个合成字体文件...")
+        build_font_dir(font_dir, args.files)
+
+        serial, stats, names = time_scan(font_dir, workers=1)
+        print(f"串行:       {serial:.3f} 秒 ({stats['parsed']} 个文件, {names} 个字体名称)")
+
+        # 临时取消阈值，强制使用进程池，用于重新评估 PARALLEL_THRESHOLD
+        threshold, fonts.PARALLEL_THRESHOLD = fonts.PARALLEL_THRESHOLD, 0
+        try:
+            parallel, stats, names = time_scan(font_dir, workers=args.workers)
+        finally:
+            fonts.PARALLEL_THRESHOLD = threshold
+        print(f"{args.workers} 进程:     {parallel:.3f} 秒 ({stats['parsed']} 个文件, {names} 个字体名称)")
+        print(f"加速比:     {serial / parallel:.2f}x")
+        print(f"单个文件:   {serial / args.files * 1e6:.0f} 微秒（串行，含写入数据库）")
+
+
+if __name__ == '__main__':
+    main()
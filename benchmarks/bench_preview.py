@@ -0,0 +1,75 @@
+"""预览基准测试：比较"全尺寸排版后缩小"与"直接按预览尺寸排版"的耗时
+
+用法: python benchmarks/bench_preview.py [--font 字体路径] [--count 60] [--width 800]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from renderer import render_class, open_background, CANVAS_WIDTH, CANVAS_HEIGHT
+from text_render import label_cache
+
+SETTINGS = {
+    'layout': {'ratio': '4:5', 'layout_type': '居中布局', 'avoid_area': '无', 'avoid_count': '2',
+               'top_margin': '270', 'bottom_margin': '650', 'side_margin': '130'},
+    'avatar': {'name_font': '', 'name_size': '40', 'name_color': '#000000', 'border_enabled': True,
+               'border_color': '#ffffff', 'border_width': '4', 'corner_radius': '0.1'},
+    'title': {'font': '', 'size': '120', 'color': '#000000', 'align': '居中',
+              'bottom_margin': '200', 'side_margin': '0'},
+}
+
+
+def make_class(folder, count, size=(1536, 2048)):
+    """生成 count 张带渐变的测试照片"""
+    vertical = Image.linear_gradient('L')
+    photo = Image.merge('RGB', [band.resize(size) for band in
+                                (vertical, vertical.transpose(Image.ROTATE_90),
+                                 vertical.transpose(Image.FLIP_TOP_BOTTOM))])
+    for i in range(count):
+        photo.save(os.path.join(folder, f"学生{i:03d}.jpg"), quality=90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--font', default=os.path.join(os.environ.get('WINDIR', ''), 'Fonts', 'msyh.ttc'))
+    parser.add_argument('--count', type=int, default=60)
+    parser.add_argument('--width', type=int, default=800, help='预览宽度（像素）')
+    args = parser.parse_args()
+
+    fonts = {'name': (args.font, 0), 'title': (args.font, 0)}
+    scale = args.width / CANVAS_WIDTH
+
+    with tempfile.TemporaryDirectory() as tmp:
+        class_path = os.path.join(tmp, '班级1')
+        os.makedirs(class_path)
+        make_class(class_path, args.count)
+        background_path = os.path.join(tmp, 'bg.jpg')
+        Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), '#e4eef8').save(background_path)
+        open_background(background_path)  # 预热背景缓存
+
+        start = time.perf_counter()
+        background = open_background(background_path)
+        render_class(background, class_path, '班级1', SETTINGS, fonts)
+        background.resize((args.width, round(CANVAS_HEIGHT * scale)))
+        full_time = time.perf_counter() - start
+
+        label_cache.clear()
+        open_background(background_path, scale)
+        start = time.perf_counter()
+        preview = open_background(background_path, scale)
+        render_class(preview, class_path, '班级1', SETTINGS, fonts, scale=scale)
+        preview_time = time.perf_counter() - start
+
+    print(f"{args.count} 人, 预览宽度 {args.width}px")
+    print(f"全尺寸排版后缩小: {full_time * 1000:8.1f} ms")
+    print(f"按预览尺寸排版:   {preview_time * 1000:8.1f} ms")
+    print(f"加速比:           {full_time / preview_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
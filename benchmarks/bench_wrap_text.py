@@ -0,0 +1,95 @@
+"""姓名换行基准测试：比较旧的逐词 textlength 换行与带宽度缓存的换行
+
+用法: python benchmarks/bench_wrap_text.py [--font 字体路径] [--size 40] [--width 190]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from fonts import load_font
+from text_render import wrap_text
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈'
+COMPOUND_SURNAMES = ['欧阳', '司马', '上官', '诸葛', '东方', '皇甫', '尉迟', '公孙']
+GIVEN = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚桂华建国志文辉婷雪琳晨宇浩然子涵梓萱一诺欣怡思远俊熙'
+MINORITY = ['阿卜杜·热合曼', '买买提·艾力', '古丽娜尔·吐尔逊', '阿依古丽·买买提', '艾合买提江·阿不都拉']
+LATIN = ['Wang Xiaoming', 'Li Na', 'Zhang Wei', 'Emily Johnson', 'Alexander Schmidt', 'Maria Garcia Lopez']
+
+
+def make_names(count, seed=0):
+    """生成接近真实分布的姓名：以 2~4 字汉族姓名为主，夹杂少数民族姓名和拼音/英文姓名"""
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.8:
+            surname = rng.choice(COMPOUND_SURNAMES) if rng.random() < 0.05 else rng.choice(SURNAMES)
+            names.append(surname + ''.join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2, 2)))))
+        elif roll < 0.9:
+            names.append(rng.choice(MINORITY))
+        else:
+            names.append(rng.choice(LATIN))
+    return names
+
+
+def legacy_wrap_text(draw, text, font, max_width):
+    """旧版换行：整串测量后按空格拆分，每个单词再测量一次"""
+    if draw.textlength(text, font=font) <= max_width:
+        return [text]
+    words = text.split(' ')
+    lines = []
+    current_line = []
+    current_width = 0
+    for word in words:
+        word_width = draw.textlength(word + ' ', font=font)
+        if current_width + word_width > max_width:
+            if current_line:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                current_width = draw.textlength(word + ' ', font=font)
+            else:
+                lines.append(word)
+                current_line = []
+                current_width = 0
+        else:
+            current_line.append(word)
+            current_width += word_width
+    if current_line:
+        lines.append(' '.join(current_line))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--font', default=os.path.join(os.environ.get('WINDIR', ''), 'Fonts', 'msyh.ttc'))
+    parser.add_argument('--index', type=int, default=0)
+    parser.add_argument('--size', type=int, default=40)
+    parser.add_argument('--width', type=int, default=190, help='换行宽度（像素）')
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+
+    font = load_font(args.font, args.index, args.size)
+    names = make_names(args.count)
+    draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+    start = time.perf_counter()
+    legacy = [legacy_wrap_text(draw, name, font, args.width) for name in names]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wrapped = [wrap_text(name, font, args.width) for name in names]
+    new_time = time.perf_counter() - start
+
+    print(f"{args.count} 个姓名, 字号 {args.size}, 换行宽度 {args.width}px")
+    print(f"旧版换行:   {legacy_time * 1000:.1f} ms ({sum(len(l) > 1 for l in legacy)} 个姓名换行)")
+    print(f"缓存换行:   {new_time * 1000:.1f} ms ({sum(len(l) > 1 for l in wrapped)} 个姓名换行)")
+    print(f"加速比:     {legacy_time / new_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""命令行批量排版（不依赖界面，可在没有显示器的服务器上运行）
+
+用法: python cli.py 背景图片 头像主文件夹 [--layout 配置文件] [--output 输出文件夹]
+
+进度以 JSON Lines 格式输出到标准输出，每行一个事件；日志输出到标准错误。
+"""
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import multiprocessing
+from fonts import FontIndex, get_font_dirs, get_default_fonts
+from renderer import make_jobs, run_batch, default_output_folder, MAX_BATCH_WORKERS
+from tile_cache import get_tile_cache, DEFAULT_TILE_CACHE_DIR
+from layout_planner import plan_cache, plans_path
+from batch_journal import BatchJournal
+
+DEFAULT_FONT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font_metadata.db')
+
+
+def emit(event, **fields):
+    """输出一行 JSON 进度事件"""
+    print(json.dumps(dict(event=event, **fields), ensure_ascii=False), flush=True)
+
+
+def load_layout(path):
+    """读取界面导出的 .layout 排版设置"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_font(font_paths, font):
+    """按字体名称或字体文件路径解析 (path, index)，找不到时返回 None"""
+    if font in font_paths and os.path.exists(font_paths[font][0]):
+        return font_paths[font]
+    if os.path.isfile(font):
+        return font, 0
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="头像排版工具命令行批量模式")
+    parser.add_argument('background', help='背景图片')
+    parser.add_argument('avatars', help='头像主文件夹（每个子文件夹为一个标题）')
+    parser.add_argument('--layout', help='排版设置文件（默认为与背景图片同名的 .layout 文件）')
+    parser.add_argument('--output', help='输出文件夹（默认为头像主文件夹上一级目录中的"排版完成"）')
+    parser.add_argument('--font-dir', action='append', default=[],
+                        help='额外的字体目录，可重复指定')
+    parser.add_argument('--font-db', default=DEFAULT_FONT_DB, help='字体索引数据库')
+    parser.add_argument('--name-font', help='覆盖姓名字体（字体名称或字体文件路径）')
+    parser.add_argument('--title-font', help='覆盖标题字体（字体名称或字体文件路径）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+    parser.add_argument('--avatar-workers', type=int, default=4, help='每个标题内处理头像的线程数')
+    parser.add_argument('--no-tile-cache', action='store_true', help='不使用头像磁盘缓存')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='忽略输出文件夹中的排版记录，重新生成所有画布')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出详细日志')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    start = time.perf_counter()
+
+    layout_path = args.layout or os.path.splitext(args.background)[0] + '.layout'
+    try:
+        settings = load_layout(layout_path)
+    except (OSError, ValueError) as e:
+        emit('error', message=f"无法读取排版设置 {layout_path}: {e}")
+        return 2
+
+    # 更新字体索引并解析姓名和标题字体
+    font_dirs = get_font_dirs() + args.font_dir
+    try:
+        with FontIndex(args.font_db) as index:
+            scan_stats = index.scan(font_dirs)
+            font_paths = get_default_fonts()
+            font_paths.update(index.load())
+    except sqlite3.OperationalError as e:
+        emit('error', message=f"无法更新字体索引 {args.font_db}: {e}")
+        return 2
+    emit('fonts', files=scan_stats['files'], parsed=scan_stats['parsed'], errors=scan_stats['errors'],
+         elapsed=round(scan_stats['elapsed'], 3))
+
+    fonts = {}
+    for key, font in (('name', args.name_font or settings['avatar']['name_font']),
+                      ('title', args.title_font or settings['title']['font'])):
+        fonts[key] = resolve_font(font_paths, font)
+        if fonts[key] is None:
+            emit('error', message=f"未找到字体: {font}（可用 --font-dir 或 --{key}-font 指定）")
+            return 2
+
+    avatars_folder = os.path.abspath(args.avatars)
+    output_folder = args.output or default_output_folder(avatars_folder)
+    tile_cache_dir = None if args.no_tile_cache else DEFAULT_TILE_CACHE_DIR
+
+    # 复用 .layout 文件旁保存的排版方案，新规划的方案写回
+    plan_cache.load(plans_path(layout_path))
+    jobs = make_jobs(args.background, avatars_folder, output_folder, settings, fonts,
+                     max(1, args.avatar_workers), tile_cache_dir)
+    if plan_cache.misses:
+        plan_cache.save(plans_path(layout_path))
+    if not jobs:
+        emit('error', message=f"未找到任何标题文件夹: {avatars_folder}")
+        return 2
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 跳过上次中断前已完成的画布（设置和头像均未变化）
+    journal = BatchJournal(output_folder)
+    skipped = 0
+    if not args.no_resume:
+        jobs, skipped = journal.pending_jobs(jobs)
+
+    workers = min(max(1, args.workers), MAX_BATCH_WORKERS)
+    emit('start', total=len(jobs), skipped=skipped, workers=workers, output=output_folder)
+    done = []
+
+    def on_result(class_name, output_path, error):
+        done.append(class_name)
+        emit('class_done', name=class_name, output=output_path, error=error,
+             done=len(done), total=len(jobs))
+
+    errors, stats = run_batch(jobs, workers, on_result, journal=journal)
+    if tile_cache_dir:
+        get_tile_cache(tile_cache_dir).trim()
+
+    emit('finished', total=len(jobs), skipped=skipped, failed=len(errors),
+         tile_hits=stats['tile_hits'], tile_misses=stats['tile_misses'],
+         elapsed=round(time.perf_counter() - start, 3))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    # 批量渲染使用进程池，打包为 exe 时需要
+    multiprocessing.freeze_support()
+    sys.exit(main())
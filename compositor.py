@@ -0,0 +1,162 @@
+import os
+import queue
+import logging
+import threading
+from PIL import Image, ImageDraw
+from renderer import (RenderCancelled, open_background, get_class_avatars, get_avatar_style, get_class_fonts,
+                      load_tiles, paste_tiles, paste_names, draw_title)
+from layout_planner import CANVAS_WIDTH, CANVAS_HEIGHT, scale_box
+
+# 图层按从下到上的顺序合成
+LAYERS = ('background', 'tiles', 'names', 'title', 'guides')
+
+
+def file_key(path):
+    """文件的依赖键（路径、修改时间、大小），文件变化后图层失效"""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class LayerCompositor:
+    """预览图层合成器：背景、头像、姓名、标题和参考线各自按依赖键缓存，键不变时直接复用"""
+
+    def __init__(self):
+        self.layers = {}  # 图层名 -> (依赖键, 图像)
+        self.rebuilt = []
+
+    def _layer(self, name, key, build, cancel=None):
+        """依赖键变化时重建图层，否则返回缓存（重建前已取消时抛出 RenderCancelled）"""
+        cached = self.layers.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        image = build()
+        self.layers[name] = (key, image)
+        self.rebuilt.append(name)
+        return image
+
+    def clear(self):
+        self.layers.clear()
+
+    def compose(self, background_path, class_path, class_name, plan, settings, fonts, scale=1.0,
+                avatar_range=None, tile_cache=None, avatar_workers=1, show_guides=False, cancel=None):
+        """按图层合成一张画布，返回 (image, rebuilt, plan)，参数含义与 render_class 相同"""
+        self.rebuilt = []
+        avatars = get_class_avatars(class_path, avatar_range)
+        scaled_plan = plan.scaled(scale)
+        size = (round(CANVAS_WIDTH * scale), round(CANVAS_HEIGHT * scale))
+        name_font, class_font = get_class_fonts(fonts, settings, scale)
+        avatar_settings = settings['avatar']
+        title_settings = settings['title']
+
+        # 背景：只依赖背景文件和缩放比例
+        background_key = (file_key(background_path), scale)
+        background = self._layer('background', background_key,
+                                 lambda: open_background(background_path, scale), cancel)
+
+        # 头像：直接合成在背景之上作为缓存的底图，依赖头像文件、位置和头像样式
+        style = get_avatar_style(settings, scale)
+        tiles_key = (background_key, tuple(file_key(path) for _, path in avatars[:len(plan.slots)]),
+                     scaled_plan.tile_size, tuple(scaled_plan.slots), style)
+
+        def build_tiles():
+            base = background.copy()
+            paste_tiles(base, scaled_plan,
+                        load_tiles(scaled_plan, avatars, style, tile_cache, avatar_workers, cancel))
+            return base
+
+        base = self._layer('tiles', tiles_key, build_tiles, cancel)
+
+        # 姓名：只保存遮罩，依赖姓名、位置、字体和字号，不依赖颜色
+        names_key = (tuple(filename for filename, _ in avatars), tuple(scaled_plan.name_boxes),
+                     scaled_plan.tile_size, fonts['name'], avatar_settings['name_size'], scale)
+
+        def build_names():
+            mask = Image.new('L', size, 0)
+            paste_names(mask, scaled_plan, avatars, name_font, 255, scale)
+            return mask
+
+        names = self._layer('names', names_key, build_names, cancel)
+
+        # 标题：只保存遮罩，依赖标题文字、字体、字号、标题区域和对齐方式，不依赖颜色
+        title_key = (class_name, fonts['title'], title_settings['size'], tuple(scaled_plan.title_box),
+                     title_settings['align'])
+
+        def build_title():
+            mask = Image.new('L', size, 0)
+            draw_title(mask, scaled_plan, class_name, class_font, title_settings['align'], 255)
+            return mask
+
+        title = self._layer('title', title_key, build_title, cancel)
+
+        # 在缓存的底图上合成文字，颜色在此时应用
+        image = base.copy()
+        image.paste(avatar_settings['name_color'], (0, 0), names)
+        image.paste(title_settings['color'], (0, 0), title)
+
+        # 参考线：依赖照片区域、标题区域和避让区域
+        if show_guides:
+            guides_key = (plan.photo_area, plan.title_box, plan.avoid_box, scale)
+            guides = self._layer('guides', guides_key, lambda: draw_guides(size, plan, scale), cancel)
+            image.paste(guides, (0, 0), guides)
+
+        logging.info(f"预览重建图层: {'、'.join(self.rebuilt) if self.rebuilt else '无（仅重新合成文字）'}")
+        return image, list(self.rebuilt), plan
+
+
+def draw_guides(size, plan, scale):
+    """绘制参考线图层：照片区域（红色）、标题区域（蓝色，上方留出一些间距）和避让区域（绿色）
+
+    plan 为未缩放的方案，参考线按预览比例缩放。
+    """
+    overlay = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw.rectangle(scale_box(plan.photo_area, scale), outline='red', width=1)
+    left, top, right, bottom = plan.title_box
+    draw.rectangle(scale_box((left, top - 20, right, bottom), scale), outline='blue', width=1)
+    if plan.avoid_box:
+        draw.rectangle(scale_box(plan.avoid_box, scale), outline='green', width=1)
+    return overlay
+
+
+class PreviewWorker:
+    """后台预览渲染线程：只保留最新的任务，完成的画面放入 results 队列"""
+
+    def __init__(self):
+        self.results = queue.Queue()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, render, context=None):
+        """提交 render(cancel)，cancel 为本任务的 threading.Event，新任务提交时被设置"""
+        with self._lock:
+            self._cancel.set()
+            self._cancel = threading.Event()
+            self._pending = (render, context, self._cancel)
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                task, self._pending = self._pending, None
+            if task is None:
+                continue
+
+            render, context, cancel = task
+            try:
+                result = render(cancel)
+            except RenderCancelled:
+                logging.info("预览渲染已被新的修改取消")
+                continue
+            except Exception as e:
+                self.results.put((context, None, e))
+                continue
+            if not cancel.is_set():
+                self.results.put((context, result, None))
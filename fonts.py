@@ -0,0 +1,339 @@
+import os
+import time
+import struct
+import sqlite3
+import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from PIL import ImageFont
+
+# 字体索引数据库版本，表结构或名称解析规则变化时递增
+SCHEMA_VERSION = 2
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+
+# 字体扫描的日志写入日志系统（命令行模式下为标准错误），标准输出只留给进度事件
+logger = logging.getLogger(__name__)
+
+# 需要收录的名称记录：1=字体族名, 4=完整名称, 6=PostScript 名称
+NAME_IDS = (1, 4, 6)
+
+# 只解码已知有效的 (平台, 编码) 组合，其余记录直接跳过
+NAME_ENCODINGS = {
+    (0, 0): 'utf-16-be', (0, 1): 'utf-16-be', (0, 2): 'utf-16-be',
+    (0, 3): 'utf-16-be', (0, 4): 'utf-16-be',   # Unicode 平台
+    (1, 0): 'mac_roman',                        # Macintosh 罗马字
+    (3, 0): 'utf-16-be',                        # Windows 符号字体
+    (3, 1): 'utf-16-be',                        # Windows Unicode BMP
+    (3, 3): 'gbk',                              # Windows 简体中文
+    (3, 4): 'big5',                             # Windows 繁体中文
+    (3, 10): 'utf-16-be',                       # Windows Unicode 完整字符集
+}
+
+# 字体索引被其他进程（界面或命令行）锁定时的最长等待时间（秒）
+DB_LOCK_TIMEOUT = 30
+
+# 缓存的 FreeType 字体对象数量上限
+FONT_CACHE_SIZE = 32
+
+# 待解析文件少于该数量时直接在当前进程解析。单个文件只读 name 表，约 25-45 微秒；
+# 进程池启动（Windows 上每个工作进程都要重新导入主模块和 tkinter）约需 0.7 秒以上，
+# 8 个进程也要上万个文件才能抵消，常见的字体目录（几百到两千个文件）始终串行更快
+PARALLEL_THRESHOLD = 20000
+
+_SCHEMA = {
+    'files': ['path', 'size', 'mtime'],
+    'fonts': ['font_name', 'font_path', 'font_index', 'last_modified'],
+}
+
+
+def get_font_dirs():
+    """获取系统字体目录和用户字体目录"""
+    dirs = []
+    if 'WINDIR' in os.environ:
+        dirs.append(os.path.join(os.environ['WINDIR'], 'Fonts'))  # 系统字体目录
+    if 'LOCALAPPDATA' in os.environ:
+        dirs.append(os.path.join(os.environ['LOCALAPPDATA'], 'Microsoft', 'Windows', 'Fonts'))  # 用户字体目录
+    if os.name != 'nt':
+        # Linux / macOS（在服务器上以命令行模式运行时）
+        home = os.path.expanduser('~')
+        dirs += ['/usr/share/fonts', '/usr/local/share/fonts',
+                 os.path.join(home, '.local', 'share', 'fonts'), os.path.join(home, '.fonts'),
+                 '/Library/Fonts', '/System/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+    return dirs
+
+
+def get_default_fonts():
+    """预设常用字体映射"""
+    fonts_dir = os.path.join(os.environ.get('WINDIR', ''), 'Fonts')
+    return {
+        '微软雅黑': (os.path.join(fonts_dir, 'msyh.ttc'), 0),
+        'Microsoft YaHei': (os.path.join(fonts_dir, 'msyh.ttc'), 0),
+        '宋体': (os.path.join(fonts_dir, 'simsun.ttc'), 0),
+        'SimSun': (os.path.join(fonts_dir, 'simsun.ttc'), 0),
+    }
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, index, size):
+    """加载 FreeType 字体对象，按 (path, face_index, size) 缓存
+
+    大型 CJK 字体集合只需解析一次，.ttc 中的字体通过 index 选择。
+    """
+    return ImageFont.truetype(path, size, index=index)
+
+
+def font_cache_info():
+    """返回字体缓存的命中/未命中统计"""
+    return load_font.cache_info()
+
+
+def _decode_name(raw, encoding):
+    """按指定编码解码名称字符串，无法解码或含 BMP 以外字符时返回 None"""
+    if encoding in ('gbk', 'big5'):
+        # Windows 平台的双字节编码会把单字节字符补成两个字节
+        raw = raw.replace(b'\x00', b'')
+    try:
+        name = raw.decode(encoding)
+    except UnicodeDecodeError:
+        return None
+    if name and all(ord(c) < 0x10000 for c in name):
+        return name
+    return None
+
+
+def _read_face_names(f, offset):
+    """读取单个字体（offset 处的 sfnt 头）的 name 表记录"""
+    f.seek(offset)
+    header = f.read(12)
+    if len(header) < 12:
+        raise ValueError("字体头不完整")
+    _, num_tables = struct.unpack_from('>4sH', header)
+
+    # 在表目录中查找 name 表
+    directory = f.read(16 * num_tables)
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack_from('>4sIII', directory, 16 * i)
+        if tag == b'name':
+            break
+    else:
+        return []
+
+    # 表偏移量始终相对于文件开头（TTC 中也是如此）
+    f.seek(table_offset)
+    data = f.read(length)
+    _, count, string_offset = struct.unpack_from('>HHH', data)
+
+    names = []
+    for i in range(count):
+        platform_id, encoding_id, _, name_id, str_length, str_offset = \
+            struct.unpack_from('>6H', data, 6 + 12 * i)
+        if name_id not in NAME_IDS:
+            continue
+        encoding = NAME_ENCODINGS.get((platform_id, encoding_id))
+        if encoding is None:
+            continue
+        start = string_offset + str_offset
+        name = _decode_name(data[start:start + str_length], encoding)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def extract_font_names(path):
+    """读取字体文件中的名称，返回 [(name, face_index), ...]
+
+    只解析 sfnt/TTC 头和每个字体的 name 表，不加载其他表。
+    """
+    with open(path, 'rb') as f:
+        tag = f.read(4)
+        if tag == b'ttcf':
+            # TTC 头：版本号、字体数量、各字体 sfnt 头的偏移量
+            _, num_fonts = struct.unpack('>II', f.read(8))
+            offsets = struct.unpack(f'>{num_fonts}I', f.read(4 * num_fonts))
+        else:
+            offsets = (0,)
+
+        names = []
+        for index, offset in enumerate(offsets):
+            names.extend((name, index) for name in _read_face_names(f, offset))
+    return names
+
+
+def scan_font_file(path, mtime):
+    """进程池工作函数：只读取 name 表，返回 (path, rows, error)
+
+    rows 为 [(name, path, face_index, mtime), ...]，由父进程统一写入数据库。
+    """
+    try:
+        rows = [(name, path, index, mtime) for name, index in extract_font_names(path)]
+        return path, rows, None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def iter_scanned_files(paths, mtimes, workers=None):
+    """并行解析字体文件，按输入顺序逐个返回 scan_font_file 的结果"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(paths) < PARALLEL_THRESHOLD:
+        yield from map(scan_font_file, paths, mtimes)
+        return
+
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(scan_font_file, paths, mtimes, chunksize=chunksize)
+
+
+def list_font_files(font_dirs):
+    """列出字体目录（包括子目录）下的所有字体文件，返回 {path: (size, mtime)}"""
+    files = {}
+    pending = [d for d in font_dirs if os.path.isdir(d)]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.lower().endswith(FONT_EXTENSIONS) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def in_font_dirs(path, font_dirs):
+    """判断路径是否位于某个字体目录（包括子目录）下"""
+    path = os.path.normcase(os.path.abspath(path))
+    return any(path.startswith(os.path.join(os.path.normcase(os.path.abspath(d)), '')) for d in font_dirs)
+
+
+class FontIndex:
+    """持久化的增量字体索引
+
+    只重新解析路径、大小或修改时间发生变化的字体文件，
+    本次扫描的目录中已删除文件的记录会被清除，所有更新在同一事务中提交。
+    界面和命令行可以共享同一个索引，各自扫描的目录互不影响。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+
+    def open(self):
+        """打开数据库，文件损坏或结构版本不匹配时重建
+
+        被其他进程锁定时最多等待 DB_LOCK_TIMEOUT 秒，仍被锁定则抛出 sqlite3.OperationalError，
+        不会删除正在共享的索引。
+        """
+        self.conn = sqlite3.connect(self.db_path, timeout=DB_LOCK_TIMEOUT)
+        try:
+            if not self._schema_ok():
+                self._create_schema()
+        except sqlite3.OperationalError:
+            self.close()
+            raise
+        except sqlite3.DatabaseError:
+            # 数据库文件损坏，删除后重建
+            self.close()
+            os.remove(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, timeout=DB_LOCK_TIMEOUT)
+            self._create_schema()
+        return self
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _schema_ok(self):
+        """检查数据库版本和表结构"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            return False
+        for table, columns in _SCHEMA.items():
+            rows = self.conn.execute(f"PRAGMA table_info({table})").fetchall()
+            if [row[1] for row in rows] != columns:
+                return False
+        return True
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS files")
+            self.conn.execute("DROP TABLE IF EXISTS fonts")
+            self.conn.execute('''CREATE TABLE files
+                                 (path TEXT PRIMARY KEY,
+                                  size INTEGER,
+                                  mtime REAL)''')
+            self.conn.execute('''CREATE TABLE fonts
+                                 (font_name TEXT,
+                                  font_path TEXT,
+                                  font_index INTEGER DEFAULT 0,
+                                  last_modified REAL,
+                                  PRIMARY KEY (font_name, font_path, font_index))''')
+            self.conn.execute("CREATE INDEX fonts_path ON fonts (font_path)")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def scan(self, font_dirs, on_parsed=None, workers=None):
+        """增量扫描字体目录，返回扫描统计
+
+        变化的文件超过 PARALLEL_THRESHOLD 个时在进程池中并行解析，只有当前进程写入数据库。
+        on_parsed(path, rows) 在每个文件解析完成后调用，用于逐步显示新字体。
+        """
+        start = time.perf_counter()
+        current = list_font_files(font_dirs)
+        known = {path: (size, mtime) for path, size, mtime in
+                 self.conn.execute("SELECT path, size, mtime FROM files")}
+
+        # 只清除本次扫描的目录中已不存在的文件，其他目录的记录保留
+        removed = [path for path in known if path not in current and in_font_dirs(path, font_dirs)]
+        changed = [path for path, stat in current.items() if known.get(path) != stat]
+
+        # 解析变化的文件（在事务外完成，避免长时间持有写锁）
+        parsed = {}
+        errors = 0
+        mtimes = [current[path][1] for path in changed]
+        for path, rows, error in iter_scanned_files(changed, mtimes, workers):
+            if error:
+                logger.warning(f"处理字体文件 {os.path.basename(path)} 时出错: {error}")
+                errors += 1
+            # 出错的文件也记录下来，避免每次启动重复解析
+            parsed[path] = rows
+            if on_parsed and rows:
+                on_parsed(path, rows)
+
+        # 一次性提交所有更新
+        with self.conn:
+            for path in removed + changed:
+                self.conn.execute("DELETE FROM fonts WHERE font_path = ?", (path,))
+                self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            for path, rows in parsed.items():
+                size, mtime = current[path]
+                self.conn.execute("INSERT INTO files VALUES (?, ?, ?)", (path, size, mtime))
+                self.conn.executemany("INSERT OR IGNORE INTO fonts VALUES (?, ?, ?, ?)", rows)
+
+        return {
+            'files': len(current),
+            'parsed': len(changed),
+            'removed': len(removed),
+            'errors': errors,
+            'elapsed': time.perf_counter() - start,
+        }
+
+    def load(self):
+        """从索引加载字体映射 {font_name: (path, index)}"""
+        font_paths = {}
+        cursor = self.conn.execute(
+            "SELECT font_name, font_path, font_index FROM fonts ORDER BY font_path, font_index"
+        )
+        for name, path, index in cursor:
+            font_paths.setdefault(name, (path, index))
+        return font_paths
@@ -1,18 +1,47 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, colorchooser
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import ImageTk
 import os
-import math
 import sys
 from tkinter.font import families
 import json
 import logging
-from fontTools.ttLib import TTFont, TTCollection
-import sqlite3
+import time
+import queue
+import threading
+import multiprocessing
 from datetime import datetime
+from fonts import FontIndex, get_font_dirs, get_default_fonts
+from renderer import (run_batch, make_jobs, split_class, list_class_folders, default_output_folder,
+                      BATCH_CANCELLED, MAX_BATCH_WORKERS)
+from layout_planner import (CANVAS_WIDTH, CANVAS_HEIGHT, layout_params, get_min_tile_width,
+                            plan_cache, plans_path)
+from compositor import LayerCompositor, PreviewWorker
+from pyramid import TilePyramid, PYRAMID_LEVELS
+from tile_cache import get_tile_cache, DEFAULT_TILE_CACHE_DIR
+from batch_journal import BatchJournal
+
+# 实时预览：设置停止修改多久后开始渲染，以及检查渲染结果的间隔（毫秒）
+PREVIEW_DEBOUNCE_MS = 300
+PREVIEW_POLL_MS = 50
+
+# 预览所需字体仍在扫描时，隔多久重新尝试渲染（毫秒）
+PREVIEW_FONT_RETRY_MS = 200
+
+# 放大查看时每次创建的图块 PhotoImage 数量
+TILES_PER_BATCH = 4
+
+# 批量生成时读取进度事件的间隔（毫秒）
+BATCH_POLL_MS = 100
+
+# 关闭窗口时等待批量生成停止的最长时间（秒），超时后不再等待
+BATCH_CLOSE_TIMEOUT = 30
 
 class ImageArranger:
     def __init__(self):
+        # 记录启动时间，用于统计首帧可交互耗时
+        self.start_time = time.perf_counter()
+        
         # Flat Remix 风格的颜色方案
         self.COLORS = {
             'primary': '#cadef0',         # 主色调（按钮）
@@ -35,6 +64,7 @@ class ImageArranger:
         # 添加以下代码来自定义标题栏颜色
         self.window.configure(bg=self.COLORS['primary'])  # 使用主题色
         self.window.overrideredirect(True)  # 移除默认标题栏
+        self.window.protocol('WM_DELETE_WINDOW', self.on_closing)
         
         # 创建自定义标题栏
         title_bar = tk.Frame(
@@ -79,7 +109,7 @@ class ImageArranger:
         btn_close = tk.Button(
             buttons_frame,
             text='×',
-            command=self.window.destroy,
+            command=self.on_closing,
             bg=self.COLORS['primary'],
             fg=self.COLORS['text_primary'],
             bd=0,
@@ -221,10 +251,48 @@ class ImageArranger:
         if hasattr(self, 'config_to_apply') and self.config_to_apply:
             self.apply_config(self.config_to_apply)
         
+        # 后台批量生成（线程、进度事件队列和取消标志）
+        self.batch = None
+        self.batch_thread = None
+        self.batch_events = None
+        self.batch_cancel = None
+        
         # 初始化预览窗口
         self.preview_window = None
         self.preview_canvas = None
         self.preview_image = None
+        
+        # 预览图层缓存，只改颜色或对齐时不必重新处理头像
+        self.preview_compositor = LayerCompositor()
+        
+        # 实时预览：设置修改后防抖，在后台线程渲染，完成的画面经队列交给界面线程
+        self.preview_worker = PreviewWorker()
+        self.live_preview = None
+        self.preview_after_id = None
+        self.preview_generation = 0
+        self.preview_shown = 0
+        self.preview_frame = None
+        
+        # 放大查看：全尺寸画面在另一个后台线程渲染，切分为图块金字塔，只显示视野内的图块
+        self.zoom_compositor = LayerCompositor()
+        self.zoom_worker = PreviewWorker()
+        self.zoom_generation = 0
+        self.zoom_pending = False
+        self.zoom_pyramid = None
+        self.zoom_plan = None
+        self.zoom_index = 0  # 0 为适应窗口，其余为 zoom_levels 中的级别
+        self.zoom_levels = list(PYRAMID_LEVELS)
+        self.zoom_anchor = None
+        self.zoom_tiles = {}  # (缩小倍数, 列, 行) -> (PhotoImage, 画布元素)
+        self.tile_queue = []
+        self.tile_refresh_pending = False
+        self.tile_load_pending = False
+        self.watch_preview_settings()
+        self.window.after(PREVIEW_POLL_MS, self.poll_preview_queue)
+        
+        # 逐步载入后台扫描到的字体，并在首帧绘制后记录启动耗时
+        self.window.after(100, self.poll_font_queue)
+        self.window.after_idle(self.report_first_frame)
     
     def setup_styles(self):
         """设置全局样式"""
@@ -251,138 +319,122 @@ class ImageArranger:
             padding=(10, 0, 0, 0)  # 左边距10像素
         )
     
-    def process_font_record(self, record, encoding):
-        """处理字体记录"""
-        try:
-            name = record.string.decode(encoding)
-            if all(ord(c) < 0x10000 for c in name):
-                return name
-        except Exception:
-            return None
-        return None
-    
     def init_fonts(self):
-        """初始化字体列表和路径"""
-        import sqlite3
-        from fontTools.ttLib import TTFont, TTCollection
-        
-        # 创建/连接数据库
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font_metadata.db')
-        
-        # 如果数据库文件存在，先删除它以确保表结构正确
-        if os.path.exists(db_path):
-            os.remove(db_path)
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 创建新的表格
-        cursor.execute('''CREATE TABLE IF NOT EXISTS fonts
-                         (font_name TEXT PRIMARY KEY, 
-                          font_path TEXT, 
-                          font_index INTEGER DEFAULT 0,
-                          last_modified REAL)''')
-        
-        # 字体目录列表
-        fonts_dirs = [
-            os.path.join(os.environ['WINDIR'], 'Fonts'),  # 系统字体目录
-            os.path.join(os.environ['LOCALAPPDATA'], 'Microsoft', 'Windows', 'Fonts')  # 用户字体目录
-        ]
-        
-        # 预设常用字体映射
-        default_fonts = {
-            '微软雅黑': (os.path.join(os.environ['WINDIR'], 'Fonts', 'msyh.ttc'), 0),
-            'Microsoft YaHei': (os.path.join(os.environ['WINDIR'], 'Fonts', 'msyh.ttc'), 0),
-            '宋体': (os.path.join(os.environ['WINDIR'], 'Fonts', 'simsun.ttc'), 0),
-            'SimSun': (os.path.join(os.environ['WINDIR'], 'Fonts', 'simsun.ttc'), 0),
-        }
+        """初始化字体列表和路径（预设字体立即可用，其余字体在后台扫描）"""
+        # 字体索引持久保存在程序目录，每次启动只增量更新
+        self.font_db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'font_metadata.db')
         
         # 初始化字体映射
         self.font_paths = {}
         self.available_fonts = []
+        self.font_list_refreshers = []  # 字体下拉框的刷新函数
+        self.font_queue = queue.Queue()  # 后台扫描结果
+        self.fonts_ready = threading.Event()  # 扫描完成标志
         
-        try:
-            # 先添加预设字体
-            for name, (path, index) in default_fonts.items():
-                if os.path.exists(path):
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO fonts VALUES (?, ?, ?, ?)",
-                        (name, path, index, os.path.getmtime(path))
-                    )
-                    self.font_paths[name] = (path, index)
-                    self.available_fonts.append(name)
-            
-            # 扫描所有字体
-            for fonts_dir in fonts_dirs:
-                if os.path.exists(fonts_dir):
-                    for file in os.listdir(fonts_dir):
-                        if file.lower().endswith(('.ttf', '.ttc', '.otf')):
-                            try:
-                                full_path = os.path.join(fonts_dir, file)
-                                mtime = os.path.getmtime(full_path)
-                                
-                                # 处理 .ttc 文件
-                                if file.lower().endswith('.ttc'):
-                                    ttc = TTCollection(full_path)
-                                    for i, font in enumerate(ttc.fonts):
-                                        name_table = font['name']
-                                        for record in name_table.names:
-                                            if record.nameID in (1, 4, 6):
-                                                for encoding in ('utf-16-be', 'utf-8', 'ascii'):
-                                                    if name := self.process_font_record(record, encoding):
-                                                        cursor.execute(
-                                                            "INSERT OR REPLACE INTO fonts VALUES (?, ?, ?, ?)",
-                                                            (name, full_path, i, mtime)
-                                                        )
-                                                        break
-                                else:
-                                    # 处理单字体文件
-                                    font = TTFont(full_path)
-                                    name_table = font['name']
-                                    for record in name_table.names:
-                                        if record.nameID in (1, 4, 6):
-                                            try:
-                                                for encoding in ('utf-16-be', 'utf-8', 'ascii'):
-                                                    try:
-                                                        name = record.string.decode(encoding)
-                                                        if all(ord(c) < 0x10000 for c in name):
-                                                            cursor.execute(
-                                                                "INSERT OR REPLACE INTO fonts VALUES (?, ?, ?, ?)",
-                                                                (name, full_path, 0, mtime)
-                                                            )
-                                                            break
-                                                    except:
-                                                        continue
-                                            except:
-                                                continue
-                                    font.close()
-                                
-                            except Exception as e:
-                                print(f"处理字体文件 {file} 时出错: {e}")
-                                continue
-            
-            # 提交更改
-            conn.commit()
-            
-            # 从数据库加载字体信息
-            cursor.execute("SELECT font_name, font_path, font_index FROM fonts")
-            for name, path, index in cursor.fetchall():
+        # 先添加预设字体
+        for name, (path, index) in get_default_fonts().items():
+            if os.path.exists(path):
                 self.font_paths[name] = (path, index)
                 self.available_fonts.append(name)
-            
-            # 对字体列表进行排序
-            self.available_fonts = sorted(list(set(self.available_fonts)))
-            
-            # 确保常用字体在列表前面
-            preferred_fonts = ['微软雅黑', '宋体', '黑体', '楷体', 'SimSun', 'SimHei', 'Microsoft YaHei']
-            for font in reversed(preferred_fonts):
-                if font in self.available_fonts:
-                    self.available_fonts.remove(font)
-                    self.available_fonts.insert(0, font)
+        self.sort_fonts()
+        
+        # 在后台线程中扫描所有字体
+        threading.Thread(target=self.scan_fonts_worker, daemon=True).start()
+    
+    def scan_fonts_worker(self):
+        """后台扫描字体（工作线程，不直接访问 Tk 控件）"""
+        try:
+            with FontIndex(self.font_db_path) as index:
+                # 先送出上次的索引结果，热启动时字体几乎立即可用
+                self.font_queue.put(('fonts', index.load()))
                 
+                def on_parsed(path, rows):
+                    self.font_queue.put(('fonts', {name: (path, i) for name, path, i, _ in rows}))
+                
+                stats = index.scan(get_font_dirs(), on_parsed)
+                self.font_queue.put(('done', index.load(), stats))
+        except Exception as e:
+            self.font_queue.put(('error', e))
         finally:
-            # 关闭数据库连接
-            conn.close()
+            self.fonts_ready.set()
+    
+    def drain_font_queue(self):
+        """将后台扫描结果合并到字体列表（在 Tk 线程中调用）"""
+        changed = False
+        while True:
+            try:
+                item = self.font_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if item[0] == 'fonts':
+                for name, path_index in item[1].items():
+                    if name not in self.font_paths:
+                        self.font_paths[name] = path_index
+                        self.available_fonts.append(name)
+                        changed = True
+            elif item[0] == 'done':
+                _, font_paths, stats = item
+                # 以最终索引为准，移除已删除的字体（保留预设字体）
+                for name in list(self.font_paths):
+                    if name not in font_paths and not os.path.exists(self.font_paths[name][0]):
+                        del self.font_paths[name]
+                for name, path_index in font_paths.items():
+                    self.font_paths.setdefault(name, path_index)
+                self.available_fonts = list(self.font_paths)
+                changed = True
+                # 记录扫描耗时，便于对比冷启动与热启动
+                logging.info(f"字体索引: 共 {stats['files']} 个文件，解析 {stats['parsed']} 个，"
+                             f"移除 {stats['removed']} 个，耗时 {stats['elapsed']:.3f} 秒")
+            elif item[0] == 'error':
+                logging.error(f"扫描字体时出错: {item[1]}")
+        
+        if changed:
+            self.sort_fonts()
+            for refresh in self.font_list_refreshers:
+                refresh()
+    
+    def poll_font_queue(self):
+        """定时检查后台扫描结果，扫描完成后停止"""
+        self.drain_font_queue()
+        if not self.fonts_ready.is_set() or not self.font_queue.empty():
+            self.window.after(100, self.poll_font_queue)
+    
+    def wait_for_font(self, font_name):
+        """字体尚未扫描到时，等待后台扫描完成（只用于生成，预览使用 fonts_known）"""
+        # 先合并已送达的结果，字体往往已在队列中，不必等待
+        self.drain_font_queue()
+        if font_name in self.font_paths:
+            return
+        
+        if not self.fonts_ready.is_set():
+            logging.info(f"字体 {font_name} 仍在扫描中，等待扫描完成...")
+            self.status_var.set("正在等待字体扫描完成...")
+            self.window.update_idletasks()
+            self.fonts_ready.wait()
+        self.drain_font_queue()
+    
+    def fonts_known(self, *font_names):
+        """不阻塞地检查字体是否都已扫描到（或扫描已完成）"""
+        self.drain_font_queue()
+        return self.fonts_ready.is_set() or all(name in self.font_paths for name in font_names)
+    
+    def sort_fonts(self):
+        """对字体列表排序，常用字体排在前面"""
+        # 对字体列表进行排序
+        self.available_fonts = sorted(list(set(self.available_fonts)))
+        
+        # 确保常用字体在列表前面
+        preferred_fonts = ['微软雅黑', '宋体', '黑体', '楷体', 'SimSun', 'SimHei', 'Microsoft YaHei']
+        for font in reversed(preferred_fonts):
+            if font in self.available_fonts:
+                self.available_fonts.remove(font)
+                self.available_fonts.insert(0, font)
+    
+    def report_first_frame(self):
+        """记录从启动到首个可交互画面的耗时"""
+        self.first_frame_time = time.perf_counter() - self.start_time
+        logging.info(f"首帧可交互耗时: {self.first_frame_time:.3f} 秒")
     
     def init_variables(self):
         """初始化所有变量"""
@@ -418,6 +470,10 @@ class ImageArranger:
         self.avoid_area_var = tk.StringVar(value="无")
         self.avoid_count_var = tk.StringVar(value="2")  # 新增避让数量变量
         
+        # 分页设置：人数过多、照片小于最小宽度时拆分为多张
+        self.split_sheets_var = tk.BooleanVar(value=False)
+        self.min_tile_width_var = tk.StringVar(value="200")
+        
         # 状态变量
         self.status_var = tk.StringVar()
         self.progress_var = tk.DoubleVar()
@@ -428,6 +484,8 @@ class ImageArranger:
         
         # 批处理模式
         self.batch_mode = tk.BooleanVar(value=False)
+        self.batch_workers_var = tk.StringVar(value=str(os.cpu_count() or 1))  # 并行进程数
+        self.avatar_workers_var = tk.StringVar(value="4")  # 单个班级内处理头像的线程数
         
         # 头像设置相关变量
         self.border_enabled = tk.BooleanVar(value=False)
@@ -489,6 +547,14 @@ class ImageArranger:
         self.create_avatar_settings(left_frame)  # 新增：头像设置
         self.create_title_settings(left_frame)   # 新增：标题设置
         
+        # 并行进程数设置
+        workers_frame = tk.Frame(left_frame, bg=self.COLORS['bg_main'])
+        workers_frame.pack(fill='x', padx=10)
+        tk.Label(workers_frame, text="并行进程数:", bg=self.COLORS['bg_main']).pack(side='left', padx=(0, 10))
+        ttk.Entry(workers_frame, textvariable=self.batch_workers_var, width=8).pack(side='left', padx=(0, 20))
+        tk.Label(workers_frame, text="头像线程数:", bg=self.COLORS['bg_main']).pack(side='left', padx=(0, 10))
+        ttk.Entry(workers_frame, textvariable=self.avatar_workers_var, width=8).pack(side='left')
+        
         # 添加按钮区域
         button_frame = tk.Frame(left_frame, bg=self.COLORS['bg_main'])
         button_frame.pack(pady=20)
@@ -505,7 +571,7 @@ class ImageArranger:
         preview_btn.pack(side='left', padx=20)
         
         # 生成按钮
-        generate_btn = tk.Button(button_frame,
+        self.generate_btn = tk.Button(button_frame,
                                text="生成排版",
                                bg='white',
                                relief='solid',
@@ -513,7 +579,19 @@ class ImageArranger:
                                width=20,
                                height=2,
                                command=self.generate_layout)
-        generate_btn.pack(side='left', padx=20)
+        self.generate_btn.pack(side='left', padx=20)
+        
+        # 取消按钮（生成过程中可用）
+        self.cancel_btn = tk.Button(button_frame,
+                               text="取消",
+                               bg='white',
+                               relief='solid',
+                               borderwidth=1,
+                               width=10,
+                               height=2,
+                               state='disabled',
+                               command=self.cancel_generate)
+        self.cancel_btn.pack(side='left', padx=20)
         
         # 添加状态栏
         status_frame = tk.Frame(left_frame, bg=self.COLORS['bg_main'])
@@ -672,6 +750,17 @@ class ImageArranger:
                     width=10,
                     state="readonly").pack(side='left')
         
+        # 分页设置
+        split_frame = tk.Frame(layout_frame, bg=self.COLORS['bg_main'])
+        split_frame.pack(fill='x', pady=5)
+        tk.Checkbutton(split_frame,
+                       text="人数过多时自动分页",
+                       variable=self.split_sheets_var,
+                       bg=self.COLORS['bg_main']).pack(side='left', padx=(0, 20))
+        
+        tk.Label(split_frame, text="最小照片宽度:", bg=self.COLORS['bg_main']).pack(side='left', padx=(0, 10))
+        ttk.Entry(split_frame, textvariable=self.min_tile_width_var, width=8).pack(side='left')
+        
         # 边距设置
         margin_frame = tk.Frame(layout_frame, bg=self.COLORS['bg_main'])
         margin_frame.pack(fill='x', pady=5)
@@ -803,12 +892,6 @@ class ImageArranger:
         if color[1]:
             self.border_color = color[1]
     
-    def choose_name_color(self):
-        """选择姓名文字颜色"""
-        color = colorchooser.askcolor(title="选择姓名文字颜色")
-        if color[1]:
-            self.name_color = color[1]
-    
     def select_background(self):
         """选择背景图片"""
         file_path = filedialog.askopenfilename(
@@ -832,8 +915,7 @@ class ImageArranger:
             logging.info(f"已选择头像文件夹: {path}")
             
             # 检查文件夹结构
-            folders = [f for f in os.listdir(path) 
-                      if os.path.isdir(os.path.join(path, f))]
+            folders = list_class_folders(path)
             if not folders:
                 messagebox.showwarning(
                     "警告", 
@@ -846,427 +928,556 @@ class ImageArranger:
             logging.info("取消选择头像文件夹")
     
     def generate_layout(self):
-        """生成布局"""
+        """生成布局：在界面线程准备任务，在后台线程批量渲染，界面定时读取进度"""
         if not self.background_path or not self.avatars_folder:
             messagebox.showwarning("提示", "请先选择背景图片和头像文件夹")
             return
         
+        if self.batch_thread is not None and self.batch_thread.is_alive():
+            messagebox.showinfo("提示", "排版正在生成中")
+            return
+        
         try:
             logging.info("开始生成排版...")
             
-            # 在生成开始时就导出设置
-            self.export_settings(self.background_path)
+            # 每张画布作为一个任务（人数过多的标题可自动分为多张），交给进程池并行渲染，
+            # 输出到上一级目录的"排版完成"
+            output_folder = default_output_folder(self.avatars_folder)
+            jobs = make_jobs(self.background_path, self.avatars_folder, output_folder,
+                             self.get_render_settings(), self.get_render_fonts(),
+                             self.get_avatar_workers(), DEFAULT_TILE_CACHE_DIR)
             
-            # 获取所有标题文件夹
-            class_folders = [f for f in os.listdir(self.avatars_folder) 
-                            if os.path.isdir(os.path.join(self.avatars_folder, f))
-                            and f != "排版结果"]
+            # 导出设置（排版方案已在创建任务时计算，一并保存）
+            self.export_settings(self.background_path)
             
-            if not class_folders:
+            if not jobs:
                 logging.error("未找到任何标题文件夹")
                 messagebox.showerror("错误", "未找到任何标题文件夹")
                 return
             
-            class_folders.sort()  # 按名称排序
-            
-            # 创建输出文件夹（在上一级目录）
-            parent_dir = os.path.dirname(self.avatars_folder)
-            output_folder = os.path.join(parent_dir, "排版完成")
             if not os.path.exists(output_folder):
                 os.makedirs(output_folder)
             
-            # 处理每个标题
-            total_classes = len(class_folders)
-            for i, class_folder in enumerate(class_folders, 1):
-                try:
-                    # 更新进度
-                    self.progress_var.set((i-1) / total_classes * 100)
-                    self.status_var.set(f"正在处理：{class_folder} ({i}/{total_classes})")
-                    self.window.update()
-                    
-                    # 打开背景图片
-                    background = Image.open(self.background_path)
-                    if background.size != (4800, 3200):
-                        background = background.resize((4800, 3200))
-                    
-                    # 处理当前标题
-                    class_path = os.path.join(self.avatars_folder, class_folder)
-                    self.process_class(background, class_path, class_folder)
-                    
-                    # 使用班级文件夹名作为文件名
-                    output_path = os.path.join(output_folder, f"{class_folder}.jpg")
-                    background.save(output_path, quality=95)
-                    
-                except Exception as e:
-                    logging.error(f"处理标题 {class_folder} 时出错: {e}")
-                    messagebox.showerror("错误", f"处理标题 {class_folder} 时出错：\n{str(e)}")
-            
-            # 完成处理
-            self.progress_var.set(100)
-            self.status_var.set("处理完成！")
-            logging.info("排版生成完成！")
-            
-            # 打开输出目录
-            os.startfile(output_folder)
-            messagebox.showinfo("完成", "排版已完成！")
+            # 上次中断或取消时已完成的画布（设置和头像均未变化）可以跳过，从中断处继续
+            journal = BatchJournal(output_folder)
+            pending, skipped = journal.pending_jobs(jobs)
+            if skipped:
+                if not pending:
+                    messagebox.showinfo("提示", f"全部 {skipped} 张画布已按当前设置生成，无需重新生成\n"
+                                              f"（如需重新生成，请删除输出文件夹中的图片）")
+                    return
+                if messagebox.askyesno("继续生成", f"上次生成已完成 {skipped} 张画布，是否跳过这些画布继续生成？\n"
+                                                 f"选择“否”将全部重新生成。"):
+                    logging.info(f"跳过已完成的 {skipped} 张画布")
+                    jobs = pending
             
         except Exception as e:
             logging.error(f"生成布局时出错: {e}")
             messagebox.showerror("错误", f"生成布局时出错: {e}")
+            return
+        
+        # 进度按头像计算：每张画布的头像数加上一次保存
+        workers = self.get_batch_workers()
+        self.batch = {
+            'output_folder': output_folder,
+            'total': len(jobs),
+            'finished': 0,
+            'avatars': {job.get('sheet_name', job['class_name']): 0 for job in jobs},
+            'encoded': 0,
+            'steps': sum(len(job['plan'].slots) + 1 for job in jobs if job.get('plan')) or 1
+        }
+        self.batch_events = multiprocessing.Queue()
+        self.batch_cancel = multiprocessing.Event()
+        self.batch_thread = threading.Thread(target=self.run_batch_thread,
+                                             args=(jobs, workers, self.batch_events, self.batch_cancel, journal),
+                                             daemon=True)
+        
+        self.progress_var.set(0)
+        self.status_var.set(f"正在处理 {len(jobs)} 张画布（{workers} 个进程）...")
+        self.generate_btn.configure(state='disabled')
+        self.cancel_btn.configure(state='normal')
+        self.batch_thread.start()
+        self.window.after(BATCH_POLL_MS, self.poll_batch_events)
 
-    def process_class(self, background, class_path, class_name):
-        """处理单个班级的照片"""
+    def run_batch_thread(self, jobs, workers, events, cancel, journal):
+        """后台线程：批量渲染并记录完成的画布，所有进度通过事件队列交给界面线程"""
         try:
-            # 获取所有头像文件
-            avatars = []
-            for filename in os.listdir(class_path):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    filepath = os.path.join(class_path, filename)
-                    avatars.append((filename, filepath))
-            
-            if not avatars:
-                logging.warning(f"文件夹 {class_name} 中没有找到头像文件")
-                return
-            
-            logging.info(f"开始处理标题: {class_name}")
-            logging.info(f"找到 {len(avatars)} 个头像文件")
-            
-            # 定义基本参数
-            side_margin = int(self.side_margin_var.get())
-            top_margin = int(self.top_margin_var.get())
-            bottom_margin = int(self.bottom_margin_var.get())
-            available_width = 4800 - 2 * side_margin
-            available_height = 3200 - top_margin - bottom_margin
-            h_spacing = 50  # 固定水平间距 - 移到这里定义
-            
-            # 计算名字所需的空间
-            name_font_size = int(self.name_size_var.get())
-            name_margin = 10  # 照片和名字之间的间距
-            name_height = name_font_size * 2  # 预留两行文字的空间
-            min_row_spacing = 50  # 最小行间距
-            
-            # 计算照片尺寸和布局
-            def calculate_layout(total_avatars, test_photo_width):
-                # 计算照片高度
-                test_photo_height = int(test_photo_width * 5 / 4) if self.ratio_var.get() == "4:5" else test_photo_width
-                
-                # 计算一个照片块的总高度
-                block_height = test_photo_height + name_margin + name_height
-                
-                # 检查是否符合高度限制
-                total_block_height = block_height * 3 + min_row_spacing * 2
-                if total_block_height > available_height:
-                    return None
-                
-                # 计算每行最多能放几张照片（使用外部的h_spacing）
-                max_per_row = (available_width + h_spacing) // (test_photo_width + h_spacing)
-                
-                # 确保至少能放下所有照片
-                if max_per_row * 3 < total_avatars:
-                    return None
-                
-                return {
-                    'photo_width': test_photo_width,
-                    'photo_height': test_photo_height,
-                    'block_height': block_height,
-                    'max_per_row': max_per_row
-                }
-            
-            # 二分查找最大可行的照片尺寸
-            total_avatars = len(avatars)
-            left = 100  # 最小照片宽度
-            right = min(available_width // 2, available_height // 4)  # 最大照片宽度
-            optimal_layout = None
-            
-            while left <= right:
-                mid = (left + right) // 2
-                layout = calculate_layout(total_avatars, mid)
-                
-                if layout:
-                    optimal_layout = layout
-                    left = mid + 1
-                else:
-                    right = mid - 1
-            
-            if not optimal_layout:
-                raise Exception("无法找到合适的布局方案")
-            
-            # 修改计算水平间距的逻辑
-            def calculate_optimal_spacing(max_row_count, photo_width):
-                # 计算最长行的总照片宽度
-                total_photos_width = photo_width * max_row_count
-                # 计算理想间距（均匀分布）
-                optimal_spacing = (available_width - total_photos_width) // (max_row_count + 1)
-                return optimal_spacing
+            def on_result(class_name, output_path, error):
+                events.put(('class_done', class_name, output_path, error))
             
-            # 使用计算出的最优布局
-            photo_width = optimal_layout['photo_width']
-            photo_height = optimal_layout['photo_height']
-            block_height = optimal_layout['block_height']
-            max_per_row = optimal_layout['max_per_row']
+            errors, stats = run_batch(jobs, workers, on_result, events=events, cancel=cancel, journal=journal)
             
-            # 重新计算每行照片数
-            if self.layout_type_var.get() == "左对齐布局":
-                row_counts = self.calculate_left_aligned_layout(total_avatars, max_per_row)
-            else:
-                row_counts = self.calculate_centered_layout(total_avatars, max_per_row)
-            
-            # 计算最优水平间距
-            max_row_count = max(row_counts)
-            h_spacing = calculate_optimal_spacing(max_row_count, photo_width)
-            
-            # 计算实际的行间距
-            total_blocks_height = block_height * 3
-            row_spacing = (available_height - total_blocks_height) // 2
-            
-            # 4. 处理每一行照片
-            draw = ImageDraw.Draw(background)
-            current_index = 0
-            
-            # 计算名字所需的空间
-            name_font_size = int(self.name_size_var.get())
-            name_margin = 10  # 照片和名字之间的间距
-            name_height = name_font_size * 2  # 预留两行文字的空间
-            
-            # 新的间距计算逻辑
-            min_row_spacing = 50  # 最小行间距
-            photo_block_height = photo_height + name_margin + name_height
-            
-            # 计算理想的行间距
-            total_height = 3200 - top_margin - bottom_margin
-            available_height = total_height - (photo_block_height * 3)
-            
-            if available_height < min_row_spacing * 2:
-                # 如果空间不足，调整照片块大小
-                total_spacing = min_row_spacing * 2
-                max_block_height = (total_height - total_spacing) // 3
-                
-                # 重新计算照片高度和名字空间
-                name_height = min(name_height, max_block_height * 0.2)  # 名字区域最多占20%
-                name_margin = min(name_margin, max_block_height * 0.05)  # 间距最多占5%
-                photo_height = max_block_height - name_height - name_margin
-                photo_width = photo_height if self.ratio_var.get() == "1:1" else int(photo_height * 4 / 5)
-                
-                row_spacing = min_row_spacing
-            else:
-                # 如果空间充足，使用均匀分配的间距
-                row_spacing = available_height // 2
-            
-            # 在循环中使用计算好的间距
-            for row, count in enumerate(row_counts):
-                # 计算当前行的y坐标，考虑照片块的总高度
-                y = top_margin + row * (photo_block_height + row_spacing)
-                
-                # 计算当前行的起始x坐标
-                if self.layout_type_var.get() == "居中布局":
-                    row_width = count * photo_width + (count - 1) * h_spacing
-                    start_x = side_margin + (available_width - row_width) // 2
+            # 淘汰超出容量的旧头像缓存
+            get_tile_cache().trim()
+            events.put(('finished', errors, stats))
+        except Exception as e:
+            events.put(('failed', str(e)))
+
+    def cancel_generate(self):
+        """请求取消批量生成：正在渲染的画布在下一张头像前停止，未开始的画布不再渲染"""
+        if self.batch_cancel is not None and self.batch_thread is not None and self.batch_thread.is_alive():
+            self.batch_cancel.set()
+            self.cancel_btn.configure(state='disabled')
+            self.status_var.set("正在取消...")
+            logging.info("正在取消排版生成...")
+
+    def poll_batch_events(self):
+        """按固定间隔读取批量生成的进度事件，更新进度条和状态"""
+        batch = self.batch
+        result = None
+        try:
+            while True:
+                event = self.batch_events.get_nowait()
+                kind = event[0]
+                if kind == 'class_started':
+                    batch['current'] = event[1]
+                elif kind == 'avatar_done':
+                    _, sheet_name, done, total = event
+                    batch['avatars'][sheet_name] = done
+                    batch['current'] = sheet_name
+                    batch['current_progress'] = (done, total)
+                elif kind == 'encode_done':
+                    batch['encoded'] += 1
+                elif kind == 'class_done':
+                    _, class_name, output_path, error = event
+                    batch['finished'] += 1
+                    if error == BATCH_CANCELLED:
+                        logging.info(f"标题 {class_name} 已取消")
+                    elif error:
+                        logging.error(f"处理标题 {class_name} 时出错: {error}")
+                    else:
+                        logging.info(f"标题 {class_name} 已保存到: {output_path}")
                 else:
-                    start_x = side_margin + h_spacing
-                
-                # 处理当前行的每张照片
-                for col in range(count):
-                    if current_index >= len(avatars):
-                        break
-                        
-                    x = start_x + col * (photo_width + h_spacing)
-                    
-                    if self.should_avoid_position(x, row, photo_width):
-                        continue
+                    result = event
+        except queue.Empty:
+            pass
+        
+        if result is None:
+            steps = sum(batch['avatars'].values()) + batch['encoded']
+            self.progress_var.set(min(steps / batch['steps'], 1) * 100)
+            if 'current_progress' in batch and not self.batch_cancel.is_set():
+                done, total = batch['current_progress']
+                self.status_var.set(f"正在处理：{batch['current']} 头像 {done}/{total}"
+                                    f"（已完成 {batch['finished']}/{batch['total']} 张画布）")
+            self.window.after(BATCH_POLL_MS, self.poll_batch_events)
+        else:
+            self.finish_batch(result)
+
+    def finish_batch(self, result):
+        """批量生成结束（完成、取消或出错）后恢复按钮并汇报结果"""
+        self.generate_btn.configure(state='normal')
+        self.cancel_btn.configure(state='disabled')
+        
+        if result[0] == 'failed':
+            logging.error(f"生成布局时出错: {result[1]}")
+            self.status_var.set("生成失败")
+            messagebox.showerror("错误", f"生成布局时出错: {result[1]}")
+            return
+        
+        _, errors, stats = result
+        
+        # 报告本次头像缓存命中率
+        lookups = stats['tile_hits'] + stats['tile_misses']
+        if lookups:
+            logging.info(f"头像缓存命中 {stats['tile_hits']}/{lookups} 次 "
+                         f"({stats['tile_hits'] / lookups:.0%})")
+        
+        cancelled = [name for name, error in errors if error == BATCH_CANCELLED]
+        errors = [(name, error) for name, error in errors if error != BATCH_CANCELLED]
+        saved = self.batch['total'] - len(cancelled) - len(errors)
+        
+        # 汇总出错的标题，统一提示
+        if errors:
+            details = "\n".join(f"{name}: {error}" for name, error in errors)
+            messagebox.showwarning("警告", f"以下 {len(errors)} 个标题处理失败：\n{details}")
+        
+        if cancelled:
+            self.status_var.set(f"已取消（已保存 {saved} 张画布）")
+            logging.info(f"排版生成已取消，已保存 {saved} 张画布")
+            messagebox.showinfo("已取消", f"排版已取消，已保存 {saved} 张画布")
+            return
+        
+        # 完成处理
+        self.progress_var.set(100)
+        self.status_var.set("处理完成！")
+        logging.info("排版生成完成！")
+        
+        # 打开输出目录
+        os.startfile(self.batch['output_folder'])
+        messagebox.showinfo("完成", "排版已完成！")
+
+    def request_preview(self, class_path, class_name, scale, target, show_guides=False):
+        """设置当前预览的班级和显示位置（'canvas' 或 'label'），立即提交后台渲染"""
+        self.live_preview = {
+            'class_path': class_path,
+            'class_name': class_name,
+            'scale': scale,
+            'target': target,
+            'show_guides': show_guides
+        }
+        
+        # 从适应窗口开始，可放大到比它更大的金字塔级别
+        self.zoom_index = 0
+        self.zoom_levels = [factor for factor in PYRAMID_LEVELS if 1 / factor > scale]
+        self.zoom_tiles = {}
+        self.status_var.set("正在生成预览...")
+        self.start_live_preview()
+
+    def watch_preview_settings(self):
+        """边距、字号、比例、避让、字体等排版设置变化时，自动刷新已打开的预览
+
+        颜色不是 Tk 变量，由 choose_name_color 和 choose_title_color 在选择后调用 schedule_live_preview，
+        合成器只在缓存的底图上重新合成文字。
+        """
+        for var in (self.top_margin_var, self.bottom_margin_var, self.side_margin_var,
+                    self.name_size_var, self.class_size_var, self.ratio_var, self.layout_type_var,
+                    self.name_font_var, self.class_font_var,
+                    self.avoid_area_var, self.avoid_count_var, self.split_sheets_var, self.min_tile_width_var,
+                    self.border_enabled, self.border_width_var, self.corner_radius_var,
+                    self.title_align_var, self.title_bottom_margin_var, self.title_side_margin_var):
+            var.trace_add('write', self.schedule_live_preview)
+
+    def schedule_live_preview(self, *args):
+        """防抖：设置停止变化一段时间后才渲染，连续输入只触发一次"""
+        if self.live_preview is None or not (self.preview_window and self.preview_window.winfo_exists()):
+            return
+        if self.preview_after_id is not None:
+            self.window.after_cancel(self.preview_after_id)
+        self.preview_after_id = self.window.after(PREVIEW_DEBOUNCE_MS, self.start_live_preview)
+
+    def make_render_task(self, compositor, scale, show_guides):
+        """在界面线程收集当前设置，返回在后台线程执行的 render(cancel)，结果为 (image, rebuilt, plan)
+
+        所选字体仍在扫描时返回 None，由调用方稍后重试，界面线程不等待扫描。
+        """
+        if not self.fonts_known(self.name_font_var.get(), self.class_font_var.get()):
+            return None
+        preview = self.live_preview
+        settings = self.get_render_settings()
+        fonts = self.get_render_fonts()
+        background_path = self.background_path
+        avatar_workers = self.get_avatar_workers()
+        # 缩小的预览头像只用于屏幕显示，每调整一次尺寸或样式就会产生一整套新文件，
+        # 不写入磁盘缓存（全尺寸的放大预览与导出结果相同，仍然使用缓存）
+        tile_cache = get_tile_cache() if scale >= 1 else None
+
+        def render(cancel):
+            # 在后台线程中执行，不访问任何 Tk 变量
+            _, avatar_range, plan = split_class(preview['class_name'], preview['class_path'],
+                                                layout_params(settings), get_min_tile_width(settings))[0]
+            return compositor.compose(
+                background_path, preview['class_path'], preview['class_name'], plan, settings, fonts,
+                scale, avatar_range, tile_cache, avatar_workers, show_guides, cancel)
+
+        return render
+
+    def start_live_preview(self):
+        """交给后台线程渲染（仍在进行的旧渲染被取消，已完成的图层保留复用）"""
+        self.preview_after_id = None
+        preview = self.live_preview
+        render = self.make_render_task(self.preview_compositor, preview['scale'], preview['show_guides'])
+        if render is None:
+            self.status_var.set("正在等待字体扫描完成...")
+            self.preview_after_id = self.window.after(PREVIEW_FONT_RETRY_MS, self.start_live_preview)
+            return
+        self.preview_generation += 1
+        self.preview_worker.submit(render, (self.preview_generation, preview))
+
+        # 设置变化后全尺寸图块失效，放大查看时重新生成
+        self.zoom_pyramid = None
+        if self.zoom_index > 0:
+            self.request_zoom_render()
+
+    def request_zoom_render(self):
+        """在后台线程渲染全尺寸画面并切分为图块金字塔"""
+        render = self.make_render_task(self.zoom_compositor, 1.0, False)
+        if render is None:
+            # 字体仍在扫描，稍后重试（已回到适应窗口时不再需要）
+            self.window.after(PREVIEW_FONT_RETRY_MS,
+                              lambda: self.zoom_index > 0 and self.zoom_pyramid is None and self.request_zoom_render())
+            return
+
+        def render_pyramid(cancel):
+            image, _, plan = render(cancel)
+            return TilePyramid(image), plan
+
+        self.zoom_generation += 1
+        self.zoom_pending = True
+        self.zoom_worker.submit(render_pyramid, self.zoom_generation)
+        self.status_var.set("正在生成全尺寸预览...")
+
+    def poll_preview_queue(self):
+        """定时取出后台渲染完成的预览画面和图块金字塔，只显示最新的结果
+
+        显示出错时只记录日志，下一次检查总会重新安排，实时预览不会因一次错误而停止。
+        """
+        try:
+            self.drain_preview_results()
+        except Exception as e:
+            logging.error(f"显示预览时出错: {e}")
+        finally:
+            self.window.after(PREVIEW_POLL_MS, self.poll_preview_queue)
+
+    def drain_preview_results(self):
+        """取出两个后台线程各自最新的结果并显示"""
+        latest = None
+        try:
+            while True:
+                latest = self.preview_worker.results.get_nowait()
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            (generation, preview), result, error = latest
+            if error is not None:
+                # 输入到一半的设置（如空的边距）无法排版，等待下一次修改
+                logging.warning(f"生成预览时出错: {error}")
+                self.status_var.set(f"预览未更新: {error}")
+            elif generation > self.preview_shown:
+                self.preview_shown = generation
+                self.show_preview_frame(preview, *result)
+
+        latest = None
+        try:
+            while True:
+                latest = self.zoom_worker.results.get_nowait()
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            generation, result, error = latest
+            if error is not None:
+                self.zoom_pending = False
+                logging.warning(f"生成全尺寸预览时出错: {error}")
+            elif generation == self.zoom_generation:
+                self.zoom_pending = False
+                self.zoom_pyramid, self.zoom_plan = result
+                if self.zoom_index > 0:
+                    self.show_zoom_level()
+                    self.status_var.set("全尺寸预览已更新")
+
+    def show_preview_frame(self, preview, image, rebuilt, plan):
+        """在预览窗口中显示渲染完成的画面（放大查看时只保存，回到适应窗口时再显示）"""
+        if not (self.preview_window and self.preview_window.winfo_exists()):
+            return
+        try:
+            if preview['target'] == 'canvas':
+                self.preview_frame = (preview, image, rebuilt, plan)
+                if self.zoom_index == 0:
+                    self.preview_image = ImageTk.PhotoImage(image)
+                    self.preview_canvas.delete('all')
+                    self.preview_canvas.create_image(0, 0, image=self.preview_image, anchor='nw')
                     
-                    filename, filepath = avatars[current_index]
-                    try:
-                        # 处理头像（包括圆角和边框）
-                        avatar = self.process_avatar(
-                            filepath,
-                            (photo_width, photo_height),
-                            self.border_color if self.border_enabled.get() else None,
-                            int(self.border_width_var.get()) if self.border_enabled.get() else 0
-                        )
-                        
-                        # 使用 alpha 通道粘贴处理后的头像
-                        background.paste(avatar, (x, y), avatar)  # 使用 avatar 作为 mask
-                        
-                        # 添加姓名 - 恢复姓名显示
-                        name = os.path.splitext(filename)[0]
-                        name_font = ImageFont.truetype(
-                            self.get_font_path(self.name_font_var.get()),
-                            name_font_size
-                        )
-                        
-                        # 将名字按照照片宽度换行
-                        wrapped_lines = self.wrap_text(draw, name, name_font, photo_width - 10)  # 留出左右各5像素边距
-                        
-                        # 计算文本总高度
-                        line_spacing = 5  # 行间距
-                        total_text_height = len(wrapped_lines) * (name_font_size + line_spacing) - line_spacing
-                        
-                        # 计算文本起始y坐标（改为上对齐）
-                        text_start_y = y + photo_height + name_margin  # 直接从照片底部开始
-                        
-                        # 绘制每一行文字
-                        for i, line in enumerate(wrapped_lines):
-                            # 计算当前行的宽度
-                            line_width = draw.textlength(line, font=name_font)
-                            # 计算x坐标使文字水平居中
-                            text_x = x + (photo_width - line_width) // 2
-                            # 计算y坐标
-                            text_y = text_start_y + i * (name_font_size + 5)  # 5是行间距
-                            # 绘制文字
-                            draw.text((text_x, text_y), line, font=name_font, fill=self.name_color)
-                        
-                        current_index += 1
-                        
-                    except Exception as e:
-                        logging.error(f"处理照片 {filename} 时出错: {e}")
-                        continue
-            
-            # 修改标题标题位置，确保下对齐
-            class_font = ImageFont.truetype(
-                self.get_font_path(self.class_font_var.get()),
-                int(self.class_size_var.get())
-            )
-            
-            # 计算文字位置，确保下对齐参考线
-            text_width = draw.textlength(class_name, font=class_font)
-            text_y = 3200 - int(self.title_bottom_margin_var.get()) - class_font.size  # 减去字体高度确保下对齐
-            
-            if self.title_align_var.get() == "居中":
-                text_x = (4800 - text_width) // 2
-            elif self.title_align_var.get() == "右对齐":
-                text_x = 4800 - side_margin - text_width
+                    # 按实际渲染的方案绘制参考线，并设置滚动区域
+                    self.create_preview(self.preview_canvas, preview['scale'], plan)
+                    self.preview_canvas.configure(scrollregion=self.preview_canvas.bbox('all'))
             else:
-                text_x = side_margin
-            
-            # 绘制文字
-            draw.text((text_x, text_y), class_name, font=class_font, fill=self.title_color)
-            
-            logging.info(f"标题 {class_name} 处理完成")
-            return True
-            
-        except Exception as e:
-            logging.error(f"处理标题 {class_name} 时出错: {e}")
-            raise
+                photo = ImageTk.PhotoImage(image)
+                self.preview_label.configure(image=photo)
+                self.preview_label.image = photo
+        except tk.TclError as e:
+            logging.warning(f"显示预览时出错: {e}")
+            return
+        self.status_var.set(f"预览已更新（重建图层: {'、'.join(rebuilt) if rebuilt else '无'}）")
+
+    def bind_preview_zoom(self, canvas):
+        """预览画布：滚轮缩放（适应窗口、1/8、1/4、1/2、1/1），按住左键拖动"""
+        canvas.bind('<MouseWheel>', lambda e: self.zoom_preview(1 if e.delta > 0 else -1, e))
+        canvas.bind('<Button-4>', lambda e: self.zoom_preview(1, e))   # Linux 滚轮
+        canvas.bind('<Button-5>', lambda e: self.zoom_preview(-1, e))
+        canvas.bind('<ButtonPress-1>', lambda e: canvas.scan_mark(e.x, e.y))
+        canvas.bind('<B1-Motion>', self.drag_preview)
+        canvas.bind('<Configure>', lambda e: self.schedule_tile_refresh())
+
+    def preview_xview(self, *args):
+        self.preview_canvas.xview(*args)
+        self.schedule_tile_refresh()
+
+    def preview_yview(self, *args):
+        self.preview_canvas.yview(*args)
+        self.schedule_tile_refresh()
+
+    def drag_preview(self, event):
+        self.preview_canvas.scan_dragto(event.x, event.y, gain=1)
+        self.schedule_tile_refresh()
+
+    def zoom_preview(self, step, event):
+        """以鼠标位置为中心切换缩放级别，全尺寸图块尚未生成时先在后台生成"""
+        if self.live_preview is None or self.live_preview['target'] != 'canvas':
+            return
+        index = min(max(self.zoom_index + step, 0), len(self.zoom_levels))
+        if index == self.zoom_index:
+            return
+
+        # 记录鼠标所指的画面位置（相对于全尺寸画布的比例），缩放后保持不动
+        canvas = self.preview_canvas
+        scale = 1 / self.zoom_levels[self.zoom_index - 1] if self.zoom_index > 0 else self.live_preview['scale']
+        self.zoom_anchor = (canvas.canvasx(event.x) / scale / CANVAS_WIDTH,
+                            canvas.canvasy(event.y) / scale / CANVAS_HEIGHT, event.x, event.y)
+        self.zoom_index = index
+
+        if index == 0:
+            # 回到适应窗口，显示最新的预览画面
+            self.zoom_tiles = {}
+            if self.preview_frame:
+                self.show_preview_frame(*self.preview_frame)
+        elif self.zoom_pyramid is None:
+            if not self.zoom_pending:
+                self.request_zoom_render()
+        else:
+            self.show_zoom_level()
+
+    def show_zoom_level(self):
+        """按当前缩放级别重建画布：设置滚动区域、恢复鼠标位置，然后加载视野内的图块"""
+        canvas = self.preview_canvas
+        factor = self.zoom_levels[self.zoom_index - 1]
+        width, height = self.zoom_pyramid.size(factor)
+        canvas.delete('all')
+        self.zoom_tiles = {}
+        canvas.configure(scrollregion=(0, 0, width, height))
 
-    def get_font_path(self, font_name):
-        # sourcery skip: inline-immediately-returned-variable
-        """获取字体文件路径"""
+        if self.zoom_anchor:
+            fraction_x, fraction_y, event_x, event_y = self.zoom_anchor
+            canvas.xview_moveto(max(0, fraction_x * width - event_x) / width)
+            canvas.yview_moveto(max(0, fraction_y * height - event_y) / height)
+
+        # 参考线在图块之上
+        self.create_preview(canvas, 1 / factor, self.zoom_plan)
+        self.refresh_zoom_tiles()
+
+    def schedule_tile_refresh(self):
+        """拖动、滚动或窗口大小变化后刷新图块（同一轮事件中只刷新一次）"""
+        if self.zoom_index > 0 and self.zoom_pyramid is not None and not self.tile_refresh_pending:
+            self.tile_refresh_pending = True
+            self.window.after_idle(self.refresh_zoom_tiles)
+
+    def refresh_zoom_tiles(self):
+        """计算视野内的图块，先加载可见图块再预取周围一圈，移除离开视野的图块"""
+        self.tile_refresh_pending = False
+        if self.zoom_index == 0 or self.zoom_pyramid is None:
+            return
+        canvas = self.preview_canvas
+        factor = self.zoom_levels[self.zoom_index - 1]
+        left, top = canvas.canvasx(0), canvas.canvasy(0)
+        box = (left, top, left + canvas.winfo_width(), top + canvas.winfo_height())
+
+        visible = self.zoom_pyramid.tiles_in_view(factor, box)
+        nearby = [tile for tile in self.zoom_pyramid.tiles_in_view(factor, box, margin=1) if tile not in visible]
+        wanted = {(factor,) + tile for tile in visible + nearby}
+
+        for key in [key for key in self.zoom_tiles if key not in wanted]:
+            canvas.delete(self.zoom_tiles.pop(key)[1])
+
+        self.tile_queue = [(factor,) + tile for tile in visible + nearby]
+        if not self.tile_load_pending:
+            self.tile_load_pending = True
+            self.window.after_idle(self.load_queued_tiles)
+
+    def load_queued_tiles(self):
+        """每次为少量图块创建 PhotoImage，避免一次创建过多阻塞界面"""
+        self.tile_load_pending = False
+        if (self.zoom_index == 0 or self.zoom_pyramid is None
+                or not (self.preview_window and self.preview_window.winfo_exists())):
+            return
+        factor = self.zoom_levels[self.zoom_index - 1]
+        loaded = 0
+        while self.tile_queue and loaded < TILES_PER_BATCH:
+            key = self.tile_queue.pop(0)
+            if key in self.zoom_tiles or key[0] != factor:
+                continue
+            left, top, image = self.zoom_pyramid.tile(*key)
+            photo = ImageTk.PhotoImage(image)
+            item = self.preview_canvas.create_image(left, top, image=photo, anchor='nw')
+            self.zoom_tiles[key] = (photo, item)
+            loaded += 1
+        self.preview_canvas.tag_raise('reference_line')
+
+        if self.tile_queue:
+            self.tile_load_pending = True
+            self.window.after(1, self.load_queued_tiles)
+
+    def get_render_settings(self):
+        """收集当前的排版设置（与导出的 .layout 文件结构相同）"""
+        return {
+            'layout': {
+                'ratio': self.ratio_var.get(),
+                'layout_type': self.layout_type_var.get(),
+                'avoid_area': self.avoid_area_var.get(),
+                'avoid_count': self.avoid_count_var.get(),
+                'split_sheets': self.split_sheets_var.get(),
+                'min_tile_width': self.min_tile_width_var.get(),
+                'top_margin': self.top_margin_var.get(),
+                'bottom_margin': self.bottom_margin_var.get(),
+                'side_margin': self.side_margin_var.get()
+            },
+            'avatar': {
+                'name_font': self.name_font_var.get(),
+                'name_size': self.name_size_var.get(),
+                'name_color': self.name_color,
+                'border_enabled': self.border_enabled.get(),
+                'border_color': self.border_color,
+                'border_width': self.border_width_var.get(),
+                'corner_radius': self.corner_radius_var.get()  # 添加圆角系数
+            },
+            'title': {
+                'font': self.class_font_var.get(),
+                'size': self.class_size_var.get(),
+                'color': self.title_color,
+                'align': self.title_align_var.get(),
+                'bottom_margin': self.title_bottom_margin_var.get(),
+                'side_margin': self.title_side_margin_var.get()
+            }
+        }
+
+    def get_render_fonts(self):
+        """解析姓名和标题字体的文件路径与索引"""
+        return {
+            'name': self.get_font_file(self.name_font_var.get()),
+            'title': self.get_font_file(self.class_font_var.get())
+        }
+
+    def get_batch_workers(self):
+        """获取批量生成的并行进程数（设置无效时使用 CPU 核数，最多 MAX_BATCH_WORKERS 个）"""
+        try:
+            workers = max(1, int(self.batch_workers_var.get()))
+        except ValueError:
+            workers = os.cpu_count() or 1
+        return min(workers, MAX_BATCH_WORKERS)
+
+    def get_avatar_workers(self):
+        """获取单个班级内处理头像的线程数（设置无效时为 1）"""
+        try:
+            return max(1, int(self.avatar_workers_var.get()))
+        except ValueError:
+            return 1
+
+    def get_font_file(self, font_name):
+        """获取字体文件路径和 .ttc 中的字体索引"""
+        # 字体仍在后台扫描时才会等待
+        self.wait_for_font(font_name)
+        
         # 直接从缓存中获取字体路径和索引
         if font_name in self.font_paths:
             path, index = self.font_paths[font_name]
             if os.path.exists(path):
-                return path
+                return path, index
         
         # 如果找不到，返回微软雅黑作为后备字体
         logging.warning(f"\n❌ 未找到字体文件: {font_name}")
         logging.warning("使用微软雅黑作为后备字体")
         msyh_path = os.path.join(os.environ['WINDIR'], 'Fonts', 'msyh.ttc')
-        return msyh_path
-
+        return msyh_path, 0
+    
     def choose_title_color(self):
         color = colorchooser.askcolor(title="选择标题颜色", color=self.title_color)
         if color[1]:
             self.title_color = color[1]
+            self.schedule_live_preview()
 
     def run(self):
         """运行程序"""
         self.window.mainloop()
 
-    def calculate_layout(self, total_avatars):
-        """计算照片布局，考虑避让区域"""
-        # 基础计算：每行平均分配
-        row_counts = [total_avatars // 3] * 3
-        remainder = total_avatars % 3
-        
-        # 如果有避让区域
-        if self.avoid_area_var.get() != "无":
-            # 确定避让行
-            avoid_row = 1 if self.avoid_area_var.get() == "中部" else 2
-            
-            # 计算避让区域占用的位置数
-            avoid_width = int(self.avoid_width_var.get())
-            side_margin = int(self.side_margin_var.get())
-            available_width = 4800 - 2 * side_margin
-            h_spacing = 50  # 固定间距
-            avatar_width = (available_width - 8 * h_spacing) // 7  # 假设最多7个位置
-            avoid_positions = math.ceil(avoid_width / (avatar_width + h_spacing))
-            
-            # 计算避让行需要的照片数（必须是双数）
-            avoid_row_count = row_counts[avoid_row]
-            if avoid_row_count - avoid_positions < 0:
-                # 如果避让区域太大，调整其他行
-                needed = avoid_positions - avoid_row_count
-                for i in range(3):
-                    if i != avoid_row and row_counts[i] > needed // 2:
-                        row_counts[i] -= needed // 2
-                        row_counts[avoid_row] += needed // 2
-                        needed -= needed // 2
-                    if needed == 0:
-                        break
-            
-            # 确保避让行是双数
-            if row_counts[avoid_row] % 2 == 1:
-                row_counts[avoid_row] += 1
-                # 从其他行借一个位置
-                for i in range(3):
-                    if i != avoid_row and row_counts[i] > 0:
-                        row_counts[i] -= 1
-                        break
-        else:
-            # 正常分配剩余照片
-            for i in range(remainder):
-                row_counts[i] += 1
-        
-        return row_counts
-
-    def get_avoid_x_range(self):
-        """计算避让区域的X坐标范围"""
-        if self.avoid_area_var.get() == "无":
-            return None
-        
-        # 获取避让照片数量
-        avoid_count = int(self.avoid_count_var.get())
-        
-        # 计算单个照片的宽度
-        side_margin = int(self.side_margin_var.get())
-        available_width = 4800 - 2 * side_margin
-        h_spacing = 50  # 固定间距
-        max_photos_per_row = 7
-        photo_width = (available_width - (max_photos_per_row + 1) * h_spacing) // max_photos_per_row
-        
-        # 计算避让区域总宽度（照片宽度 + 间距）* 照片数量
-        avoid_width = (photo_width + h_spacing) * avoid_count
-        
-        # 计算避让区域的起始和结束位置
-        center_x = 4800 // 2
-        start_x = center_x - avoid_width // 2
-        end_x = center_x + avoid_width // 2
-        
-        return (start_x, end_x)
-    
-    def should_avoid_position(self, x, row, avatar_width):
-        """检查位置是否需要避让"""
-        if self.avoid_area_var.get() == "无":
-            return False
-            
-        avoid_range = self.get_avoid_x_range()
-        if not avoid_range:
-            return False
-            
-        # 只在需要避让的行进行检查
-        target_row = 1 if self.avoid_area_var.get() == "中部" else 2
-        if row != target_row:
-            return False
-            
-        # 检查照片是否与避让区域有重叠
-        photo_left = x
-        photo_right = x + avatar_width
-        
-        # 检查是否与避让区域有任何重叠（增加容差）
-        tolerance = 10  # 10像素的容差
-        return not (photo_right <= avoid_range[0] - tolerance or 
-                   photo_left >= avoid_range[1] + tolerance)
-
     def save_config(self):
         config = {
             'name_font': self.name_font_var.get(),
@@ -1284,7 +1495,11 @@ class ImageArranger:
             'title_side_margin': self.title_side_margin_var.get(),
             'avoid_area': self.avoid_area_var.get(),
             'avoid_count': self.avoid_count_var.get(),
-            'name_color': self.name_color  # 新增姓名颜色
+            'split_sheets': self.split_sheets_var.get(),
+            'min_tile_width': self.min_tile_width_var.get(),
+            'name_color': self.name_color,  # 新增姓名颜色
+            'batch_workers': self.batch_workers_var.get(),
+            'avatar_workers': self.avatar_workers_var.get()
         }
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -1315,19 +1530,8 @@ class ImageArranger:
             # 创建预览窗口
             self.show_preview()
             
-            # 等待窗口渲染完成
-            self.preview_window.update()
-            self.preview_window.after(100)
-            
-            # 打开背景图片并创建副本
-            background = Image.open(self.background_path)  # 确保这里 self.background_path 不为 None
-            if background.size != (4800, 3200):
-                background = background.resize((4800, 3200))
-            
             # 获取第一个文件夹的信息
-            class_folders = [f for f in os.listdir(self.avatars_folder) 
-                            if os.path.isdir(os.path.join(self.avatars_folder, f))
-                            and f != "排版结果"]
+            class_folders = list_class_folders(self.avatars_folder)
             
             if not class_folders:
                 logging.error("未找到任何标题文件夹")
@@ -1338,32 +1542,15 @@ class ImageArranger:
             first_class = class_folders[0]
             class_path = os.path.join(self.avatars_folder, first_class)
             
-            # 处理第一个文件夹的头像和标题
-            self.process_class(background, class_path, first_class)
-            
-            # 计算缩放比例（调整到80%）
+            # 计算缩放比例
             screen_width = self.window.winfo_screenwidth()
             screen_height = self.window.winfo_screenheight()
-            width_scale = (screen_width * 0.5) / 4800  # 从 0.6 改为 0.8
-            height_scale = (screen_height * 0.5) / 3200  # 从 0.6 改为 0.8
+            width_scale = (screen_width * 0.5) / CANVAS_WIDTH
+            height_scale = (screen_height * 0.5) / CANVAS_HEIGHT
             scale = min(width_scale, height_scale)
             
-            # 缩放图片
-            preview_width = int(4800 * scale)
-            preview_height = int(3200 * scale)
-            background = background.resize((preview_width, preview_height))
-            
-            # 转换为PhotoImage
-            self.preview_image = ImageTk.PhotoImage(background)
-            
-            # 在画布上显示图片
-            self.preview_canvas.create_image(0, 0, image=self.preview_image, anchor='nw')
-            
-            # 创建预览内容（参考线等）
-            self.create_preview(self.preview_canvas, scale)
-            
-            # 设置滚动区域
-            self.preview_canvas.configure(scrollregion=self.preview_canvas.bbox('all'))
+            # 在后台线程按预览尺寸分层合成第一个文件夹，完成后显示在画布上
+            self.request_preview(class_path, first_class, scale, 'canvas')
             
         except Exception as e:
             logging.error(f"创建预览时出错: {e}")
@@ -1436,19 +1623,49 @@ class ImageArranger:
                 self.avoid_area_var.set(config['avoid_area'])
             if 'avoid_count' in config:
                 self.avoid_count_var.set(config['avoid_count'])
+            if 'split_sheets' in config:
+                self.split_sheets_var.set(config['split_sheets'])
+            if 'min_tile_width' in config:
+                self.min_tile_width_var.set(config['min_tile_width'])
             if 'name_color' in config:
                 self.name_color = config['name_color']
+            if 'batch_workers' in config:
+                self.batch_workers_var.set(config['batch_workers'])
+            if 'avatar_workers' in config:
+                self.avatar_workers_var.set(config['avatar_workers'])
         except Exception as e:
             logging.error(f"应用配置时出错: {e}")
 
     def on_closing(self):
-        """窗口关闭时保存配置"""
+        """窗口关闭时保存配置，并停止仍在进行的批量生成"""
         try:
             self.save_config()
         except Exception as e:
             logging.error(f"保存配置时出错: {e}")
+        
+        # 取消后台批量生成并等待其结束：正在渲染的画布在下一张头像前停止，
+        # 未开始的画布被取消，避免窗口关闭后进程池仍在后台渲染整批任务
+        if self.batch_thread is not None and self.batch_thread.is_alive():
+            logging.info("正在取消排版生成...")
+            self.batch_cancel.set()
+            self.window.withdraw()
+            # 等待时持续读走进度事件，工作进程不会阻塞在 queue.put 上；超时后不再等待
+            deadline = time.monotonic() + BATCH_CLOSE_TIMEOUT
+            while self.batch_thread.is_alive() and time.monotonic() < deadline:
+                self.discard_batch_events()
+                self.batch_thread.join(0.1)
+            if self.batch_thread.is_alive():
+                logging.warning("批量生成未能及时停止，直接关闭窗口")
         self.window.destroy()
 
+    def discard_batch_events(self):
+        """丢弃队列中尚未读取的批量生成进度事件"""
+        try:
+            while True:
+                self.batch_events.get_nowait()
+        except queue.Empty:
+            pass
+
     def preview_first_class(self):
         """预览第一个文件夹的排版效果"""
         if not self.background_path or not self.avatars_folder:
@@ -1456,9 +1673,8 @@ class ImageArranger:
             return
         
         try:
-            # 获取第一个文件夹
-            folders = [f for f in os.listdir(self.avatars_folder) 
-                      if os.path.isdir(os.path.join(self.avatars_folder, f))]
+            # 获取第一个文件夹（与批量生成的顺序相同）
+            folders = list_class_folders(self.avatars_folder)
             if not folders:
                 messagebox.showerror("错误", "未找到有效的标题文件夹")
                 return
@@ -1481,11 +1697,11 @@ class ImageArranger:
             max_preview_height = int(screen_height * 0.8)
             
             preview_width = max_preview_width
-            preview_height = int(3200 * preview_width / 4800)
+            preview_height = int(CANVAS_HEIGHT * preview_width / CANVAS_WIDTH)
             
             if preview_height > max_preview_height:
                 preview_height = max_preview_height
-                preview_width = int(4800 * preview_height / 3200)
+                preview_width = int(CANVAS_WIDTH * preview_height / CANVAS_HEIGHT)
             
             # 设置窗口位置
             window_x = (screen_width - preview_width) // 2
@@ -1513,70 +1729,8 @@ class ImageArranger:
                          width=15,
                          height=2).pack(side='left', padx=10)
             
-            # 生成预览图
-            background = Image.open(self.background_path)
-            if background.size != (4800, 3200):
-                background = background.resize((4800, 3200))
-            
-            # 绘制参考线
-            draw = ImageDraw.Draw(background)
-            
-            # 获取边距值
-            top_margin = int(self.top_margin_var.get())
-            bottom_margin = int(self.bottom_margin_var.get())
-            side_margin = int(self.side_margin_var.get())  # 统一的左右边距
-            
-            # 绘制照片区域边界线（红色）
-            draw.line([(side_margin, top_margin), (4800-side_margin, top_margin)], fill='red', width=2)
-            draw.line([(side_margin, 3200-bottom_margin), (4800-side_margin, 3200-bottom_margin)], fill='red', width=2)
-            draw.line([(side_margin, top_margin), (side_margin, 3200-bottom_margin)], fill='red', width=2)
-            draw.line([(4800-side_margin, top_margin), (4800-side_margin, 3200-bottom_margin)], fill='red', width=2)
-            
-            # 绘制标题边界线（蓝色）
-            title_bottom = int(self.title_bottom_margin_var.get())
-            title_height = int(self.class_size_var.get()) + 20  # 字体大小加上一些间距
-            
-            # 绘制标题参考框
-            y_bottom = 3200 - title_bottom
-            y_top = y_bottom - title_height
-            draw.line([(side_margin, y_bottom), (4800-side_margin, y_bottom)], fill='blue', width=2)
-            draw.line([(side_margin, y_top), (side_margin, y_bottom)], fill='blue', width=2)
-            draw.line([(4800-side_margin, y_top), (4800-side_margin, y_bottom)], fill='blue', width=2)
-            draw.line([(side_margin, y_top), (4800-side_margin, y_top)], fill='blue', width=2)
-            
-            # 绘制避让区域（绿色）
-            if self.avoid_area_var.get() != "无":
-                avoid_range = self.get_avoid_x_range()
-                if avoid_range:
-                    if self.avoid_area_var.get() == "中部":
-                        # 中部避让：在第二行中间
-                        row_height = (3200 - top_margin - bottom_margin) / 3
-                        y_center = top_margin + row_height * 1.5
-                        avoid_height = 400
-                        y1 = int(y_center - avoid_height/2)
-                        y2 = int(y_center + avoid_height/2)
-                    else:
-                        # 下部避让：在第三行中间
-                        row_height = (3200 - top_margin - bottom_margin) / 3
-                        y_center = top_margin + row_height * 2.5
-                        avoid_height = 400
-                        y1 = int(y_center - avoid_height/2)
-                        y2 = int(y_center + avoid_height/2)
-                    
-                    draw.rectangle([avoid_range[0], y1, avoid_range[1], y2], outline='green', width=2)
-            
-            # 处理排版
-            self.process_class(background, class_path, first_folder)
-            
-            # 缩放预览图
-            preview_width = 800
-            preview_height = int(3200 * preview_width / 4800)
-            preview_img = background.resize((preview_width, preview_height))
-            
-            # 更新预览图
-            photo = ImageTk.PhotoImage(preview_img)
-            self.preview_label.configure(image=photo)
-            self.preview_label.image = photo
+            # 在后台线程按预览尺寸分层合成预览图，参考线作为最上层（与排版使用同一套规划参数）
+            self.request_preview(class_path, first_folder, 800 / CANVAS_WIDTH, 'label', show_guides=True)
             
             # 将预览窗口提到前台
             self.preview_window.lift()
@@ -1585,91 +1739,6 @@ class ImageArranger:
             logging.error(f"生成预览时出错: {e}")
             messagebox.showerror("错误", f"生成预览时出错：\n{str(e)}")
 
-    def wrap_text(self, draw, text, font, max_width):
-        """处理文本换行，保留空格"""
-        # 如果文本宽度小于最大宽度，直接返回
-        if draw.textlength(text, font=font) <= max_width:
-            return [text]
-        
-        # 保留原始空格，将文本分割成单词
-        words = text.split(' ')
-        lines = []
-        current_line = []
-        current_width = 0
-        
-        for word in words:
-            # 计算当前单词的宽度（包括一个空格）
-            word_width = draw.textlength(word + ' ', font=font)
-            
-            # 如果加上这个单词会超出宽度限制
-            if current_width + word_width > max_width:
-                if current_line:  # 如果当前行有内容
-                    # 将当前行的单词用空格连接并添加到结果中
-                    lines.append(' '.join(current_line))
-                    # 开始新的一行
-                    current_line = [word]
-                    current_width = draw.textlength(word + ' ', font=font)
-                else:
-                    # 如果单个单词就超过最大宽度，强制添加
-                    lines.append(word)
-                    current_line = []
-                    current_width = 0
-            else:
-                # 如果没有超出宽度限制，添加到当前行
-                current_line.append(word)
-                current_width += word_width
-        
-        # 添加最后一行
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        return lines
-
-    def calculate_left_aligned_layout(self, total_avatars, max_per_row):
-        """计算左对齐布局的每行照片数，考虑最大限制"""
-        # 基础分配
-        base = min(total_avatars // 3, max_per_row)
-        remainder = total_avatars - base * 3
-        
-        row_counts = [base, base, base]
-        
-        # 分配剩余的照片
-        if remainder == 1:
-            # 余1时，第三行少两个位置
-            if row_counts[0] < max_per_row:
-                row_counts[0] += 1
-                row_counts[1] += 1
-                row_counts[2] -= 1
-        elif remainder == 2:
-            # 余2时给前两行各加1
-            if row_counts[0] < max_per_row and row_counts[1] < max_per_row:
-                row_counts[0] += 1
-                row_counts[1] += 1
-        
-        return row_counts
-
-    def calculate_centered_layout(self, total_avatars, max_per_row):
-        """计算居中布局的每行照片数，考虑最大限制"""
-        # 基础分配
-        base = min(total_avatars // 3, max_per_row)
-        remainder = total_avatars - base * 3
-        
-        row_counts = [base, base, base]
-        
-        # 修改余数分配逻辑
-        if remainder == 1:
-            # 余1时给中间行
-            if row_counts[1] < max_per_row:
-                row_counts[1] += 1
-        elif remainder == 2:
-            # 余2时给第一行和第三行
-            if row_counts[0] < max_per_row:
-                row_counts[0] += 1
-            if row_counts[2] < max_per_row:
-                row_counts[2] += 1
-        
-        return row_counts
-
     def create_font_combobox(self, parent, var, width=20):
         """创建可搜索的字体下拉框"""
         frame = tk.Frame(parent, bg=self.COLORS['bg_main'])
@@ -1692,9 +1761,17 @@ class ImageArranger:
         scrollbar.pack(side="right", fill="y")
         listbox.pack(side="left", fill="both", expand=True)
         
-        # 初始填充字体列表
+        def refresh_list():
+            search_text = entry.get().lower()
+            listbox.delete(0, tk.END)
+            for font in self.available_fonts:
+                if search_text in font.lower():
+                    listbox.insert(tk.END, font)
+        
+        # 初始填充字体列表（先是预设字体，后台扫描完成后逐步补充）
         for font in self.available_fonts:
             listbox.insert(tk.END, font)
+        self.font_list_refreshers.append(refresh_list)
         
         def show_listbox():
             x = entry.winfo_rootx()
@@ -1707,11 +1784,7 @@ class ImageArranger:
             listbox_window.withdraw()
         
         def update_list(event=None):
-            search_text = entry.get().lower()
-            listbox.delete(0, tk.END)
-            for font in self.available_fonts:
-                if search_text in font.lower():
-                    listbox.insert(tk.END, font)
+            refresh_list()
             show_listbox()
         
         def on_select(event):
@@ -1743,82 +1816,6 @@ class ImageArranger:
         
         return frame, entry
 
-    def process_avatar(self, avatar_path, size, border_color=None, border_size=0):
-        """处理头像图片"""
-        try:
-            # 打开并裁剪照片
-            with Image.open(avatar_path) as img:
-                # 转换为RGB模式
-                img = img.convert('RGB')
-                
-                # 计算裁剪尺寸以保持比例
-                target_ratio = 4/5 if self.ratio_var.get() == "4:5" else 1
-                current_ratio = img.width / img.height
-                
-                if current_ratio > target_ratio:
-                    # 图片太宽，需要裁剪宽度
-                    new_width = int(img.height * target_ratio)
-                    left = (img.width - new_width) // 2
-                    img = img.crop((left, 0, left + new_width, img.height))
-                else:
-                    # 图片太高，需要裁剪高度
-                    new_height = int(img.width / target_ratio)
-                    top = (img.height - new_height) // 2
-                    img = img.crop((0, top, img.width, top + new_height))
-                
-                # 调整大小
-                img = img.resize(size)
-                
-                # 转换为RGBA模式以支持透明度
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # 获取圆角系数
-                corner_radius = float(self.corner_radius_var.get()) if self.corner_radius_var.get() else 0
-                
-                # 如果需要圆角，创建圆角遮罩
-                if corner_radius > 0:
-                    mask = Image.new('L', size, 0)
-                    draw = ImageDraw.Draw(mask)
-                    
-                    # 计算圆角半径
-                    r = min(size[0], size[1]) * corner_radius
-                    
-                    # 使用 rounded_rectangle 创建真正的圆角
-                    draw.rounded_rectangle(
-                        [0, 0, size[0]-1, size[1]-1],  # 矩形区域
-                        radius=r,                       # 圆角半径
-                        fill=255                        # 填充颜色
-                    )
-                    
-                    # 应用遮罩
-                    img.putalpha(mask)
-                
-                # 如果需要添加边框
-                if border_color and border_size > 0:
-                    result = Image.new('RGBA', size, border_color)
-                    
-                    if corner_radius > 0:
-                        result.putalpha(mask)
-                    
-                    # 计算内部图像尺寸
-                    inner_size = (size[0] - 2*border_size, size[1] - 2*border_size)
-                    inner_img = img.resize(inner_size)
-                    
-                    # 粘贴内部图像
-                    x = (size[0] - inner_size[0]) // 2
-                    y = (size[1] - inner_size[1]) // 2
-                    result.paste(inner_img, (x, y), inner_img if corner_radius > 0 else None)
-                    
-                    return result
-                else:
-                    return img
-        
-        except Exception as e:
-            logging.error(f"处理头像时出错: {e}")
-            logging.error("错误详情:", exc_info=True)
-            return Image.new('RGBA', size, (200, 200, 200, 255))
-
     def save_result(self, image, class_path):
         """保存处理结果"""
         try:
@@ -1868,12 +1865,12 @@ class ImageArranger:
             # 计算预览图片的尺寸
             screen_width = self.window.winfo_screenwidth()
             screen_height = self.window.winfo_screenheight()
-            width_scale = (screen_width * 0.5) / 4800
-            height_scale = (screen_height * 0.5) / 3200
+            width_scale = (screen_width * 0.5) / CANVAS_WIDTH
+            height_scale = (screen_height * 0.5) / CANVAS_HEIGHT
             self.preview_scale = min(width_scale, height_scale)  # 保存缩放比例
             
-            preview_width = int(4800 * self.preview_scale)
-            preview_height = int(3200 * self.preview_scale)
+            preview_width = int(CANVAS_WIDTH * self.preview_scale)
+            preview_height = int(CANVAS_HEIGHT * self.preview_scale)
             
             # 设置窗口大小
             window_width = preview_width + 200
@@ -1890,8 +1887,8 @@ class ImageArranger:
             
             # 创建画布和滚动条
             self.preview_canvas = tk.Canvas(canvas_frame, bg=self.COLORS['bg_light'])
-            h_scrollbar = ttk.Scrollbar(canvas_frame, orient='horizontal', command=self.preview_canvas.xview)
-            v_scrollbar = ttk.Scrollbar(canvas_frame, orient='vertical', command=self.preview_canvas.yview)
+            h_scrollbar = ttk.Scrollbar(canvas_frame, orient='horizontal', command=self.preview_xview)
+            v_scrollbar = ttk.Scrollbar(canvas_frame, orient='vertical', command=self.preview_yview)
             
             # 配置画布的滚动
             self.preview_canvas.configure(
@@ -1903,6 +1900,7 @@ class ImageArranger:
             h_scrollbar.pack(side='bottom', fill='x')
             v_scrollbar.pack(side='right', fill='y')
             self.preview_canvas.pack(side='left', fill='both', expand=True)
+            self.bind_preview_zoom(self.preview_canvas)
             
             # 添加按钮
             button_frame = tk.Frame(self.preview_window, bg=self.COLORS['bg_light'])
@@ -1922,93 +1920,25 @@ class ImageArranger:
     def update_preview(self):
         """更新预览图片"""
         try:
-            # 创建预览图片
-            self.create_preview(self.preview_canvas, self.preview_scale)
-            
             # 更新画布上的图片
             self.preview_canvas.delete("all")  # 清除旧图片
-            self.preview_canvas.create_image(0, 0, image=self.preview_image, anchor='nw')
+            if self.preview_image is not None:
+                self.preview_canvas.create_image(0, 0, image=self.preview_image, anchor='nw')
+            
+            # 按上一次渲染的方案绘制参考线（新的画面由后台渲染完成后显示）
+            if self.preview_frame:
+                preview, _, _, plan = self.preview_frame
+                self.create_preview(self.preview_canvas, preview['scale'], plan)
             
         except Exception as e:
             logging.error(f"更新预览图片时出错: {e}")
 
-    def create_preview(self, canvas, scale):
-        """在画布上创建预览内容"""
-        preview_width = int(4800 * scale)
-        preview_height = int(3200 * scale)
-        
-        # 获取布局设置中的边距
-        layout_type = self.layout_type_var.get()
-        layout_margin = int(self.side_margin_var.get())  # 使用布局设置中的边距值
-        top_margin = int(self.top_margin_var.get()) * scale  # 使用设置的上边距
-        bottom_margin_red = int(self.bottom_margin_var.get()) * scale  # 使用设置的下边距
-        
-        # 根据布局类型设置左右边距
-        if layout_type == "左对齐布局":
-            left_margin = layout_margin * scale
-            right_margin = preview_width - (layout_margin * scale)
-        else:  # 居中布局
-            left_margin = layout_margin * scale
-            right_margin = preview_width - (layout_margin * scale)
-        
-        # 添加头像区域参考线（红色）
-        # 上边界水平线
-        canvas.create_line(
-            left_margin, top_margin, 
-            right_margin, top_margin, 
-            fill='red', width=2, tags='reference_line'
-        )
-        # 下边界水平线
-        canvas.create_line(
-            left_margin, preview_height - bottom_margin_red, 
-            right_margin, preview_height - bottom_margin_red, 
-            fill='red', width=2, tags='reference_line'
-        )
-        # 左边界垂直线
-        canvas.create_line(
-            left_margin, top_margin,
-            left_margin, preview_height - bottom_margin_red,
-            fill='red', width=2, tags='reference_line'
-        )
-        # 右边界垂直线
-        canvas.create_line(
-            right_margin, top_margin,
-            right_margin, preview_height - bottom_margin_red,
-            fill='red', width=2, tags='reference_line'
-        )
-        
-        # 添加标题参考线（蓝色）
-        class_font_size = int(self.class_size_var.get()) * scale
-        bottom_margin = int(self.title_bottom_margin_var.get()) * scale
-        
-        # 标题区域使用相同的左右边距
-        # 底部水平线
-        bottom_line = canvas.create_line(
-            left_margin, preview_height - bottom_margin,
-            right_margin, preview_height - bottom_margin,
-            fill='blue', width=2, tags='reference_line'
-        )
-        
-        # 顶部水平线
-        top_line = canvas.create_line(
-            left_margin, preview_height - bottom_margin - class_font_size,
-            right_margin, preview_height - bottom_margin - class_font_size,
-            fill='blue', width=2, tags='reference_line'
-        )
-        
-        # 左侧垂直线
-        canvas.create_line(
-            left_margin, preview_height - bottom_margin - class_font_size,
-            left_margin, preview_height - bottom_margin,
-            fill='blue', width=2, tags='reference_line'
-        )
-        
-        # 右侧垂直线
-        canvas.create_line(
-            right_margin, preview_height - bottom_margin - class_font_size,
-            right_margin, preview_height - bottom_margin,
-            fill='blue', width=2, tags='reference_line'
-        )
+    def create_preview(self, canvas, scale, plan):
+        """在画布上按渲染使用的排版方案绘制参考线（不读取界面中可能输入到一半的设置）"""
+        # 头像区域参考线（红色）和标题参考线（蓝色），按预览比例缩放
+        for box, color in ((plan.photo_area, 'red'), (plan.title_box, 'blue')):
+            left, top, right, bottom = (value * scale for value in box)
+            canvas.create_rectangle(left, top, right, bottom, outline=color, width=2, tags='reference_line')
 
     def generate_from_preview(self):
         """从预览状态生成最终图片"""
@@ -2025,34 +1955,7 @@ class ImageArranger:
 
     def export_settings(self, background_path):
         """导出当前布局设置"""
-        settings = {
-            'layout': {
-                'ratio': self.ratio_var.get(),
-                'layout_type': self.layout_type_var.get(),
-                'avoid_area': self.avoid_area_var.get(),
-                'avoid_count': self.avoid_count_var.get(),
-                'top_margin': self.top_margin_var.get(),
-                'bottom_margin': self.bottom_margin_var.get(),
-                'side_margin': self.side_margin_var.get()
-            },
-            'avatar': {
-                'name_font': self.name_font_var.get(),
-                'name_size': self.name_size_var.get(),
-                'name_color': self.name_color,
-                'border_enabled': self.border_enabled.get(),
-                'border_color': self.border_color,
-                'border_width': self.border_width_var.get(),
-                'corner_radius': self.corner_radius_var.get()  # 添加圆角系数
-            },
-            'title': {
-                'font': self.class_font_var.get(),
-                'size': self.class_size_var.get(),
-                'color': self.title_color,
-                'align': self.title_align_var.get(),
-                'bottom_margin': self.title_bottom_margin_var.get(),
-                'side_margin': self.title_side_margin_var.get()
-            }
-        }
+        settings = self.get_render_settings()
         
         # 生成配置文件路径（与背景图片同名，但后缀为 .layout）
         config_path = os.path.splitext(background_path)[0] + '.layout'
@@ -2061,6 +1964,9 @@ class ImageArranger:
             with open(config_path, 'w', encoding='utf-8') as f:
                 json.dump(settings, f, ensure_ascii=False, indent=4)
             logging.info(f"布局设置已保存到: {config_path}")
+            
+            # 排版方案缓存保存在 .layout 文件旁，下次打开同一背景时复用
+            plan_cache.save(plans_path(config_path))
         except Exception as e:
             logging.error(f"保存布局设置时出错: {e}")
             messagebox.showerror("错误", f"保存布局设置时出错: {e}")
@@ -2083,6 +1989,8 @@ class ImageArranger:
             self.layout_type_var.set(layout.get('layout_type', '左对齐布局'))
             self.avoid_area_var.set(layout.get('avoid_area', '无'))
             self.avoid_count_var.set(layout.get('avoid_count', '2'))
+            self.split_sheets_var.set(layout.get('split_sheets', False))
+            self.min_tile_width_var.set(layout.get('min_tile_width', '200'))
             self.top_margin_var.set(layout.get('top_margin', '270'))
             self.bottom_margin_var.set(layout.get('bottom_margin', '650'))
             self.side_margin_var.set(layout.get('side_margin', '130'))
@@ -2107,6 +2015,11 @@ class ImageArranger:
             self.title_side_margin_var.set(title.get('side_margin', '0'))
             
             logging.info(f"已从 {config_path} 导入布局设置")
+            
+            # 加载上次保存的排版方案
+            loaded = plan_cache.load(plans_path(config_path))
+            if loaded:
+                logging.info(f"已加载 {loaded} 个排版方案")
         except Exception as e:
             logging.error(f"导入布局设置时出错: {e}")
             messagebox.showerror("错误", f"导入布局设置时出错: {e}")
@@ -2116,6 +2029,7 @@ class ImageArranger:
         color = colorchooser.askcolor(title="选择姓名文字颜色")
         if color[1]:
             self.name_color = color[1]
+            self.schedule_live_preview()
 
     def add_hover_effect(self, widget, hover_color, normal_color):
         """添加鼠标悬浮效果"""
@@ -0,0 +1,459 @@
+"""排版规划：只根据参数和头像数量计算坐标，不接触任何图片"""
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+# 画布尺寸（背景统一调整到该尺寸）
+CANVAS_WIDTH = 4800
+CANVAS_HEIGHT = 3200
+
+MIN_PHOTO_WIDTH = 100  # 最小照片宽度
+MIN_ROW_SPACING = 50   # 最小行间距
+MIN_ROWS = 3           # 最少行数（人数较少时保持三行排法）
+NAME_MARGIN = 10       # 照片和名字之间的间距
+AVOID_HEIGHT = 400     # 避让区域参考框的高度
+
+# 规划算法版本，算法变化导致方案不同时递增，旧的方案缓存文件随之失效
+PLAN_VERSION = 4
+
+# 缓存的排版方案数量上限
+PLAN_CACHE_SIZE = 1024
+
+
+class LayoutPlan:
+    """排版方案：照片尺寸、每个位置的坐标、姓名区域和标题区域（矩形均为 (left, top, right, bottom)）"""
+
+    def __init__(self, total_avatars, tile_size, slots, name_boxes, row_counts, guides):
+        self.total_avatars = total_avatars  # 规划时的头像数量
+        self.tile_size = tile_size          # 照片尺寸 (width, height)
+        self.slots = slots                  # 每张照片左上角的 (x, y)，按排版顺序
+        self.name_boxes = name_boxes        # 每张照片下方的姓名区域
+        self.row_counts = row_counts        # 每行放置的照片数（避让行已扣除被占用的位置）
+        self.photo_area = guides['photo_area']
+        self.title_box = guides['title_box']
+        self.avoid_box = guides['avoid_box']
+
+    def scaled(self, scale):
+        """按预览比例缩放的方案（坐标四舍五入为整数像素）"""
+        if scale == 1:
+            return self
+        return LayoutPlan(self.total_avatars,
+                          scale_box(self.tile_size, scale),
+                          [scale_box(slot, scale) for slot in self.slots],
+                          [scale_box(box, scale) for box in self.name_boxes],
+                          self.row_counts,
+                          {'photo_area': scale_box(self.photo_area, scale),
+                           'title_box': scale_box(self.title_box, scale),
+                           'avoid_box': scale_box(self.avoid_box, scale)})
+
+    def to_dict(self):
+        """转换为可保存为 JSON 的 dict"""
+        return {
+            'total_avatars': self.total_avatars,
+            'tile_size': self.tile_size,
+            'slots': self.slots,
+            'name_boxes': self.name_boxes,
+            'row_counts': self.row_counts,
+            'guides': {'photo_area': self.photo_area, 'title_box': self.title_box,
+                       'avoid_box': self.avoid_box},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 to_dict 的结果恢复（JSON 中的列表还原为元组）"""
+        guides = {key: tuple(box) if box else None for key, box in data['guides'].items()}
+        return cls(data['total_avatars'],
+                   tuple(data['tile_size']),
+                   [tuple(slot) for slot in data['slots']],
+                   [tuple(box) for box in data['name_boxes']],
+                   list(data['row_counts']),
+                   guides)
+
+
+def scale_box(values, scale):
+    """按比例缩放坐标、尺寸或矩形（None 原样返回）"""
+    if values is None:
+        return None
+    return tuple(round(value * scale) for value in values)
+
+
+def layout_params(settings):
+    """把 .layout 设置（界面中的字符串值）转换为规划参数"""
+    layout = settings['layout']
+    avoid_area = layout['avoid_area']
+    return {
+        'ratio': layout['ratio'],
+        'layout_type': layout['layout_type'],
+        'avoid_area': avoid_area,
+        'avoid_count': int(layout['avoid_count']) if avoid_area != "无" else 0,
+        'top_margin': int(layout['top_margin']),
+        'bottom_margin': int(layout['bottom_margin']),
+        'side_margin': int(layout['side_margin']),
+        'name_size': int(settings['avatar']['name_size']),
+        'title_size': int(settings['title']['size']),
+        'title_bottom_margin': int(settings['title']['bottom_margin']),
+    }
+
+
+def get_min_tile_width(settings):
+    """自动分页时的最小照片宽度，未启用分页时为 0（旧的 .layout 文件没有该设置）"""
+    layout = settings['layout']
+    if not layout.get('split_sheets'):
+        return 0
+    return int(layout.get('min_tile_width') or 0)
+
+
+def calculate_left_aligned_layout(total_avatars, max_per_row, rows=3):
+    """计算左对齐布局的每行照片数：从第一行起依次排满，最后一行放剩余的照片"""
+    per_row = min(-(-total_avatars // rows), max_per_row)
+    row_counts = []
+    remaining = total_avatars
+    for _ in range(rows):
+        count = min(per_row, remaining)
+        row_counts.append(count)
+        remaining -= count
+    return row_counts
+
+
+def calculate_centered_layout(total_avatars, max_per_row, rows=3):
+    """计算居中布局的每行照片数：余数成对分配给首尾对称的行，保持整体居中"""
+    base, extra = divmod(total_avatars, rows)
+    row_counts = [base] * rows
+
+    # 成对分配，从首尾两行向中间
+    pairs = extra // 2
+    for i in range(pairs):
+        row_counts[i] += 1
+        row_counts[rows - 1 - i] += 1
+
+    # 多出的一张：行数为奇数时放中间一行；为偶数时没有中间一行，放未分到成对照片的最下面一行
+    if extra % 2 == 1:
+        row_counts[rows // 2 if rows % 2 == 1 else rows - 1 - pairs] += 1
+
+    return [min(count, max_per_row) for count in row_counts]
+
+
+def get_avoid_x_range(params):
+    """计算避让区域的X坐标范围，不避让时返回 None"""
+    if params['avoid_area'] == "无":
+        return None
+
+    # 计算单个照片的宽度
+    available_width = CANVAS_WIDTH - 2 * params['side_margin']
+    h_spacing = 50  # 固定间距
+    max_photos_per_row = 7
+    photo_width = (available_width - (max_photos_per_row + 1) * h_spacing) // max_photos_per_row
+
+    # 计算避让区域总宽度（照片宽度 + 间距）* 照片数量
+    avoid_width = (photo_width + h_spacing) * params['avoid_count']
+
+    # 计算避让区域的起始和结束位置
+    center_x = CANVAS_WIDTH // 2
+    return (center_x - avoid_width // 2, center_x + avoid_width // 2)
+
+
+def should_avoid_position(avoid_range, x, avatar_width):
+    """检查避让行中的位置是否与避让区域重叠"""
+    if not avoid_range:
+        return False
+
+    # 检查是否与避让区域有任何重叠（增加容差）
+    tolerance = 10  # 10像素的容差
+    return not (x + avatar_width <= avoid_range[0] - tolerance or
+                x >= avoid_range[1] + tolerance)
+
+
+def get_avoid_rows(params, rows):
+    """避让区域垂直居中对准的行 (上, 下)，不避让时返回 None"""
+    if params['avoid_area'] == "中部":
+        # 行数为偶数时对准中间两行，避让区域位于两行之间
+        return (rows - 1) // 2, rows // 2
+    if params['avoid_area'] == "下部":
+        return rows - 1, rows - 1
+    return None
+
+
+def spacing_for(photo_width):
+    """估算间距：正常尺寸的照片固定为 50 像素，人数很多、照片很小时按比例缩小"""
+    return min(50, max(10, photo_width // 5))
+
+
+def block_size(params, photo_width):
+    """照片高度和一个照片块（照片 + 姓名）的总高度"""
+    photo_height = int(photo_width * 5 / 4) if params['ratio'] == "4:5" else photo_width
+    name_height = params['name_size'] * 2  # 预留两行文字的空间
+    return photo_height, photo_height + NAME_MARGIN + name_height
+
+
+def max_photos_per_row(params, photo_width):
+    """一行最多能放的照片数（按最小间距计算）"""
+    available_width = CANVAS_WIDTH - 2 * params['side_margin']
+    gap = spacing_for(photo_width)
+    return (available_width + gap) // (photo_width + gap)
+
+
+def row_positions(params, rows, block_height):
+    """每行照片的 Y 坐标：行间距平分剩余高度"""
+    available_height = CANVAS_HEIGHT - params['top_margin'] - params['bottom_margin']
+    row_spacing = (available_height - block_height * rows) // (rows - 1)
+    return [params['top_margin'] + row * (block_height + row_spacing) for row in range(rows)]
+
+
+def plan_avoidance(params, rows, photo_width):
+    """按实际的行位置计算避让，返回 (row_ys, avoid_box, avoided_rows, free_x)"""
+    photo_height, block_height = block_size(params, photo_width)
+    row_ys = row_positions(params, rows, block_height)
+    avoid_range = get_avoid_x_range(params)
+    if not avoid_range:
+        return row_ys, None, set(), []
+
+    upper, lower = get_avoid_rows(params, rows)
+    y_center = (row_ys[upper] + row_ys[lower]) // 2 + photo_height // 2
+    avoid_box = (avoid_range[0], y_center - AVOID_HEIGHT // 2, avoid_range[1], y_center + AVOID_HEIGHT // 2)
+    avoided_rows = {row for row, y in enumerate(row_ys) if y < avoid_box[3] and y + block_height > avoid_box[1]}
+
+    side_margin = params['side_margin']
+    available_width = CANVAS_WIDTH - 2 * side_margin
+    max_per_row = max_photos_per_row(params, photo_width)
+    h_spacing = (available_width - photo_width * max_per_row) // (max_per_row + 1)
+    grid = [side_margin + h_spacing + col * (photo_width + h_spacing) for col in range(max_per_row)]
+    free_x = [x for x in grid if not should_avoid_position(avoid_range, x, photo_width)]
+    return row_ys, avoid_box, avoided_rows, free_x
+
+
+def row_capacities(params, rows, photo_width):
+    """每行最多能放的照片数，避让行扣除与避让区域重叠的位置"""
+    max_per_row = max_photos_per_row(params, photo_width)
+    _, _, avoided_rows, free_x = plan_avoidance(params, rows, photo_width)
+    return [len(free_x) if row in avoided_rows else max_per_row for row in range(rows)]
+
+
+def fit_row_counts(row_counts, capacities, centered=False):
+    """把超出行容量的照片移到仍有空位的行（没有避让时结果不变）"""
+    counts = [min(count, capacity) for count, capacity in zip(row_counts, capacities)]
+    leftover = sum(row_counts) - sum(counts)
+    if not centered:
+        for row, capacity in enumerate(capacities):
+            extra = min(leftover, capacity - counts[row])
+            counts[row] += extra
+            leftover -= extra
+        return counts
+
+    # 居中布局从首尾两行向中间每行一张轮流分配，保持上下对称
+    rows = len(counts)
+    order = list(dict.fromkeys(row for i in range(rows) for row in (i, rows - 1 - i)))
+    while leftover:
+        free = [row for row in order if counts[row] < capacities[row]][:leftover]
+        if not free:
+            break
+        for row in free:
+            counts[row] += 1
+        leftover -= len(free)
+    return counts
+
+
+def plan_guides(params, avoid_box=None):
+    """计算参考线：照片区域、标题文字区域，以及 plan_layout 按行位置算出的避让区域"""
+    side_margin = params['side_margin']
+    top_margin = params['top_margin']
+    photo_bottom = CANVAS_HEIGHT - params['bottom_margin']
+    photo_area = (side_margin, top_margin, CANVAS_WIDTH - side_margin, photo_bottom)
+
+    # 标题文字下对齐到底部边距
+    title_bottom = CANVAS_HEIGHT - params['title_bottom_margin']
+    title_box = (side_margin, title_bottom - params['title_size'], CANVAS_WIDTH - side_margin, title_bottom)
+
+    return {'photo_area': photo_area, 'title_box': title_box, 'avoid_box': avoid_box}
+
+
+def solve_tile_size(total_avatars, params):
+    """同时搜索行数和照片宽度，返回照片最大的 (rows, photo_width, photo_height, block_height)"""
+    available_width = CANVAS_WIDTH - 2 * params['side_margin']
+    available_height = CANVAS_HEIGHT - params['top_margin'] - params['bottom_margin']
+    avoiding = params['avoid_area'] != "无"
+
+    def fits_height(rows, photo_width):
+        _, block_height = block_size(params, photo_width)
+        gap = min(MIN_ROW_SPACING, spacing_for(photo_width))
+        return block_height * rows + gap * (rows - 1) <= available_height
+
+    def fits(rows, photo_width):
+        # 每行最多能放几张照片，并确保 rows 行能放下所有照片
+        if max_photos_per_row(params, photo_width) * rows < total_avatars or not fits_height(rows, photo_width):
+            return False
+        return not avoiding or sum(row_capacities(params, rows, photo_width)) >= total_avatars
+
+    best = None
+    max_width = min(available_width // 2, available_height // 4)  # 最大照片宽度
+    rows = MIN_ROWS
+    while fits_height(rows, best[1] + 1 if best else MIN_PHOTO_WIDTH):
+        # 二分查找该行数下最大可行的照片宽度
+        left, right = MIN_PHOTO_WIDTH, max_width
+        width = None
+        while left <= right:
+            mid = (left + right) // 2
+            if fits(rows, mid):
+                width = mid
+                left = mid + 1
+            else:
+                right = mid - 1
+
+        # 宽度相同时保留行数较少的方案
+        if width and (best is None or width > best[1]):
+            best = (rows, width) + block_size(params, width)
+        rows += 1
+
+    if not best:
+        raise ValueError("无法找到合适的布局方案")
+    return best
+
+
+def plan_sheets(total_avatars, params, min_tile_width=0):
+    """把人数平均拆分到尽量少的几张画布上，使每张的照片宽度不小于 min_tile_width"""
+    if not min_tile_width or total_avatars <= 1:
+        return [total_avatars]
+
+    for sheets in range(1, total_avatars + 1):
+        per_sheet = -(-total_avatars // sheets)
+        try:
+            plan = plan_layout(per_sheet, params)
+        except ValueError:
+            continue
+        if plan.tile_size[0] >= min_tile_width and len(plan.slots) >= per_sheet:
+            base, extra = divmod(total_avatars, sheets)
+            return [base + 1 if i < extra else base for i in range(sheets)]
+
+    raise ValueError(f"最小照片宽度 {min_tile_width} 超过了单张照片能达到的最大宽度")
+
+
+def plan_layout(total_avatars, params):
+    """计算 total_avatars 张照片的排版方案"""
+    side_margin = params['side_margin']
+    available_width = CANVAS_WIDTH - 2 * side_margin
+    name_height = params['name_size'] * 2
+
+    rows, photo_width, photo_height, block_height = solve_tile_size(total_avatars, params)
+    max_per_row = max_photos_per_row(params, photo_width)
+    row_ys, avoid_box, avoided_rows, free_x = plan_avoidance(params, rows, photo_width)
+
+    # 计算每行照片数，超出避让行容量的照片移到其他行
+    if params['layout_type'] == "左对齐布局":
+        row_counts = calculate_left_aligned_layout(total_avatars, max_per_row, rows)
+    else:
+        row_counts = calculate_centered_layout(total_avatars, max_per_row, rows)
+    row_counts = fit_row_counts(row_counts, row_capacities(params, rows, photo_width),
+                                params['layout_type'] != "左对齐布局")
+
+    # 按最长的一行均匀分布水平间距
+    max_row_count = max(row_counts)
+    h_spacing = (available_width - photo_width * max_row_count) // (max_row_count + 1)
+
+    # 确定每张照片的位置
+    slots = []
+    for row, count in enumerate(row_counts):
+        y = row_ys[row]
+
+        if row in avoided_rows:
+            # 避让行：居中布局取最靠近中间的空位（紧贴避让区域两侧），左对齐布局从左取
+            if params['layout_type'] == "居中布局":
+                center = CANVAS_WIDTH / 2
+                xs = sorted(sorted(free_x, key=lambda x: abs(x + photo_width / 2 - center))[:count])
+            else:
+                xs = free_x[:count]
+        else:
+            # 计算当前行的起始x坐标
+            if params['layout_type'] == "居中布局":
+                row_width = count * photo_width + (count - 1) * h_spacing
+                start_x = side_margin + (available_width - row_width) // 2
+            else:
+                start_x = side_margin + h_spacing
+            xs = [start_x + col * (photo_width + h_spacing) for col in range(count)]
+
+        slots.extend((x, y) for x in xs)
+
+    # 姓名区域紧接在照片下方，宽度与照片相同
+    name_boxes = [(x, y + photo_height + NAME_MARGIN,
+                   x + photo_width, y + photo_height + NAME_MARGIN + name_height)
+                  for x, y in slots]
+
+    return LayoutPlan(total_avatars, (photo_width, photo_height), slots, name_boxes, row_counts,
+                      plan_guides(params, avoid_box))
+
+
+def plans_path(layout_path):
+    """方案缓存文件路径：与 .layout 文件同名，后缀为 .plans"""
+    return os.path.splitext(layout_path)[0] + '.plans'
+
+
+class PlanCache:
+    """排版方案缓存，按 (头像数量, 规划参数) 缓存 plan_layout 的结果（线程安全）"""
+
+    def __init__(self, maxsize=PLAN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(total_avatars, params):
+        return (total_avatars,) + tuple(sorted(params.items()))
+
+    def get(self, total_avatars, params):
+        """获取排版方案，没有缓存时规划（无法排版时抛出 ValueError）"""
+        key = self._key(total_avatars, params)
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = plan_layout(total_avatars, params)
+        with self.lock:
+            self.plans[key] = plan
+            if len(self.plans) > self.maxsize:
+                self.plans.popitem(last=False)
+        return plan
+
+    def load(self, path):
+        """从文件加载方案，文件不存在、损坏或版本不同时忽略，返回加载的数量"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != PLAN_VERSION:
+                return 0
+            loaded = 0
+            for entry in data['plans']:
+                key = self._key(entry['count'], entry['params'])
+                plan = LayoutPlan.from_dict(entry['plan'])
+                with self.lock:
+                    self.plans.setdefault(key, plan)
+                loaded += 1
+            return loaded
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"读取排版方案缓存 {path} 时出错: {e}")
+            return 0
+
+    def save(self, path):
+        """保存所有方案"""
+        with self.lock:
+            plans = [{'count': key[0], 'params': dict(key[1:]), 'plan': plan.to_dict()}
+                     for key, plan in self.plans.items()]
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'version': PLAN_VERSION, 'plans': plans}, f, ensure_ascii=False)
+        except OSError as e:
+            logging.warning(f"保存排版方案缓存 {path} 时出错: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
+
+
+# 全局排版方案缓存，在多个班级、多次预览和生成之间共享
+plan_cache = PlanCache()
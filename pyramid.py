@@ -0,0 +1,51 @@
+"""预览图块金字塔：把全尺寸画面按多个缩放级别切成小块，缩放和拖动时只显示视野内的图块"""
+import math
+
+# 缩放级别（缩小倍数）：1/8、1/4、1/2、1/1
+PYRAMID_LEVELS = (8, 4, 2, 1)
+
+# 图块边长（像素）
+PYRAMID_TILE_SIZE = 256
+
+
+class TilePyramid:
+    """全尺寸画面的多级缩小版本，按需裁剪成固定大小的图块
+
+    各级在构建时一次生成（整数倍缩小，速度很快），图块只在显示时裁剪，
+    界面只需为视野内的少量图块创建 PhotoImage，不必构建整张 4800×3200 的图片。
+    """
+
+    def __init__(self, image, levels=PYRAMID_LEVELS, tile_size=PYRAMID_TILE_SIZE):
+        self.tile_size = tile_size
+        self.levels = {factor: image if factor == 1 else image.reduce(factor) for factor in levels}
+
+    def size(self, factor):
+        return self.levels[factor].size
+
+    def tiles_in_view(self, factor, box, margin=0):
+        """与视野 box (left, top, right, bottom) 相交的图块 (col, row)
+
+        margin 为向外多取的图块圈数（用于预取），结果按离视野中心的距离排序，
+        先加载的图块总在视野中央。
+        """
+        width, height = self.size(factor)
+        size = self.tile_size
+        left, top, right, bottom = box
+        first_col = max(0, int(left // size) - margin)
+        first_row = max(0, int(top // size) - margin)
+        last_col = min(math.ceil(width / size), math.ceil(right / size) + margin)
+        last_row = min(math.ceil(height / size), math.ceil(bottom / size) + margin)
+
+        center_x, center_y = (left + right) / 2, (top + bottom) / 2
+        tiles = [(col, row) for row in range(first_row, last_row) for col in range(first_col, last_col)]
+        tiles.sort(key=lambda tile: ((tile[0] + 0.5) * size - center_x) ** 2
+                   + ((tile[1] + 0.5) * size - center_y) ** 2)
+        return tiles
+
+    def tile(self, factor, col, row):
+        """裁剪一个图块，返回 (left, top, image)"""
+        image = self.levels[factor]
+        left, top = col * self.tile_size, row * self.tile_size
+        right = min(left + self.tile_size, image.width)
+        bottom = min(top + self.tile_size, image.height)
+        return left, top, image.crop((left, top, right, bottom))
@@ -0,0 +1,487 @@
+import os
+import math
+import logging
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from PIL import Image, ImageDraw
+from fonts import load_font, font_cache_info
+from text_render import label_cache
+from tile_cache import get_tile_cache
+from atomic_save import save_atomic
+from layout_planner import (CANVAS_WIDTH, CANVAS_HEIGHT, layout_params, get_min_tile_width,
+                            plan_sheets, plan_cache)
+
+AVATAR_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# 圆角遮罩的超采样倍数
+MASK_SUPERSAMPLE = 4
+
+# 批量渲染被取消时，未完成画布报告的错误
+BATCH_CANCELLED = "已取消"
+
+# 批量渲染的最大进程数（Windows 上 ProcessPoolExecutor 超过 61 个进程会抛出 ValueError）
+MAX_BATCH_WORKERS = 61
+
+
+def list_avatars(class_path):
+    """获取文件夹中的所有头像文件（按文件名排序），返回 [(filename, filepath), ...]"""
+    avatars = []
+    for filename in sorted(os.listdir(class_path)):
+        if filename.lower().endswith(AVATAR_EXTENSIONS):
+            avatars.append((filename, os.path.join(class_path, filename)))
+    return avatars
+
+
+# 已解码的背景底图，路径或修改时间变化时重新加载
+_background_cache = {}
+_background_lock = threading.Lock()
+
+
+def open_background(background_path, scale=1.0):
+    """获取背景画布的副本（解码和缩放结果按文件状态缓存，scale 小于 1 时为预览尺寸）"""
+    stat = os.stat(background_path)
+    key = (os.path.abspath(background_path), stat.st_mtime_ns, stat.st_size)
+    with _background_lock:
+        if _background_cache.get('key') != key:
+            with Image.open(background_path) as image:
+                base = image.convert('RGB')
+            if base.size != (CANVAS_WIDTH, CANVAS_HEIGHT):
+                base = base.resize((CANVAS_WIDTH, CANVAS_HEIGHT))
+            _background_cache['key'] = key
+            _background_cache['image'] = base
+            _background_cache['scaled'] = {}
+        base = _background_cache['image']
+        if scale != 1:
+            size = (round(CANVAS_WIDTH * scale), round(CANVAS_HEIGHT * scale))
+            scaled = _background_cache['scaled']
+            if size not in scaled:
+                scaled[size] = base.resize(size, Image.LANCZOS)
+            base = scaled[size]
+    return base.copy()
+
+
+def draft_for_tile(img, size, target_ratio):
+    """JPEG 按 DCT 缩放解码：选择裁剪后仍不小于目标尺寸的最小解码分辨率"""
+    if img.format != 'JPEG':
+        return
+
+    # 按比例裁剪后保留的源图区域
+    width, height = img.size
+    if width / height > target_ratio:
+        crop_width, crop_height = height * target_ratio, height
+    else:
+        crop_width, crop_height = width, width / target_ratio
+
+    scale = max(size[0] / crop_width, size[1] / crop_height)
+    if scale < 1:
+        img.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+
+
+@functools.lru_cache(maxsize=64)
+def rounded_mask(size, radius):
+    """圆角矩形遮罩（超采样抗锯齿，结果共享，调用方不能修改）"""
+    factor = MASK_SUPERSAMPLE
+    big = Image.new('L', (size[0] * factor, size[1] * factor), 0)
+    ImageDraw.Draw(big).rounded_rectangle(
+        [0, 0, big.width - 1, big.height - 1],
+        radius=radius * factor,
+        fill=255
+    )
+    return big.resize(size, Image.LANCZOS)
+
+
+@functools.lru_cache(maxsize=64)
+def tile_masks(size, radius, border_width=0):
+    """返回头像的 (外轮廓遮罩, 内部照片遮罩)，有边框时内部使用同心的小圆角"""
+    outer = rounded_mask(size, radius)
+    if border_width <= 0:
+        return outer, outer
+    inner_size = (size[0] - 2 * border_width, size[1] - 2 * border_width)
+    inner = rounded_mask(inner_size, max(radius - border_width, 0))
+    return outer, inner
+
+
+def process_avatar(avatar_path, size, ratio="4:5", corner_radius=0, border_color=None, border_size=0,
+                   tile_cache=None):
+    """处理头像图片，指定 tile_cache 时优先读取磁盘缓存"""
+    style = (ratio, corner_radius, border_color, border_size)
+    if tile_cache is not None:
+        tile = tile_cache.get(avatar_path, size, style)
+        if tile is not None:
+            return tile
+
+    try:
+        tile = build_avatar_tile(avatar_path, size, ratio, corner_radius, border_color, border_size)
+    except Exception as e:
+        logging.error(f"处理头像时出错: {e}")
+        logging.error("错误详情:", exc_info=True)
+        return Image.new('RGBA', size, (200, 200, 200, 255))
+
+    if tile_cache is not None:
+        tile_cache.put(avatar_path, size, style, tile)
+    return tile
+
+
+def crop_box(width, height, target_ratio):
+    """按目标比例居中裁剪时保留的源图区域 (left, top, right, bottom)"""
+    if width / height > target_ratio:
+        # 图片太宽，需要裁剪宽度
+        new_width = int(height * target_ratio)
+        left = (width - new_width) // 2
+        return (left, 0, left + new_width, height)
+    else:
+        # 图片太高，需要裁剪高度
+        new_height = int(width / target_ratio)
+        top = (height - new_height) // 2
+        return (0, top, width, top + new_height)
+
+
+def build_avatar_tile(avatar_path, size, ratio="4:5", corner_radius=0, border_color=None, border_size=0):
+    """裁剪、缩放头像并添加圆角和边框（有圆角时为 RGBA，否则为 RGB）"""
+    target_ratio = 4/5 if ratio == "4:5" else 1
+    has_border = bool(border_color) and border_size > 0
+
+    # 照片直接缩放到最终尺寸（有边框时为边框内的尺寸），只重采样一次
+    if has_border:
+        photo_size = (size[0] - 2*border_size, size[1] - 2*border_size)
+    else:
+        photo_size = size
+
+    with Image.open(avatar_path) as img:
+        # 大尺寸 JPEG 直接以缩小的分辨率解码
+        draft_for_tile(img, photo_size, target_ratio)
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # 裁剪和缩放合并为一步：只对源图的裁剪区域重采样
+        photo = img.resize(photo_size, Image.LANCZOS,
+                           box=crop_box(img.width, img.height, target_ratio))
+
+    # 圆角遮罩按尺寸、半径和边框宽度共享，不在每张头像上重新绘制
+    if corner_radius > 0:
+        r = min(size[0], size[1]) * corner_radius
+        outer_mask, inner_mask = tile_masks(size, r, border_size if has_border else 0)
+
+    if not has_border:
+        if corner_radius > 0:
+            photo.putalpha(outer_mask)
+        return photo
+
+    # 在边框颜色的底图上居中粘贴照片，最后统一加上外轮廓的透明度
+    result = Image.new('RGB', size, border_color)
+    result.paste(photo, (border_size, border_size), inner_mask if corner_radius > 0 else None)
+    if corner_radius > 0:
+        result.putalpha(outer_mask)
+    return result
+
+
+def scale_length(length, scale):
+    """按预览比例缩放长度（非零长度至少保留 1 像素）"""
+    if scale == 1 or length <= 0:
+        return length
+    return max(1, round(length * scale))
+
+
+def map_in_threads(func, items, workers):
+    """按输入顺序返回 func(item) 的结果，workers > 1 时在线程池中并行执行"""
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(func, items)
+
+
+def get_avatar_style(settings, scale=1.0):
+    """头像样式参数 (ratio, corner_radius, border_color, border_width)，边框宽度按比例缩放"""
+    avatar_settings = settings['avatar']
+    corner_radius = float(avatar_settings['corner_radius']) if avatar_settings['corner_radius'] else 0
+    border_enabled = avatar_settings['border_enabled']
+    border_color = avatar_settings['border_color'] if border_enabled else None
+    border_width = scale_length(int(avatar_settings['border_width']), scale) if border_enabled else 0
+    return settings['layout']['ratio'], corner_radius, border_color, border_width
+
+
+def get_class_avatars(class_path, avatar_range=None):
+    """获取班级（分页时为本张画布）的头像列表"""
+    avatars = list_avatars(class_path)
+    if avatar_range:
+        avatars = avatars[avatar_range[0]:avatar_range[1]]
+    return avatars
+
+
+class RenderCancelled(Exception):
+    """渲染被取消（例如预览设置又被修改）"""
+
+
+def load_tiles(plan, avatars, style, tile_cache=None, avatar_workers=1, cancel=None):
+    """按 plan.slots 依次处理头像（线程池并行），cancel 设置后抛出 RenderCancelled"""
+    def load_avatar(avatar):
+        # 处理头像（包括圆角和边框），可在线程池中并行执行
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        _, filepath = avatar
+        return process_avatar(filepath, plan.tile_size, *style, tile_cache=tile_cache)
+
+    return map_in_threads(load_avatar, avatars[:len(plan.slots)], avatar_workers)
+
+
+def paste_tiles(canvas, plan, tiles, progress=None):
+    """按方案位置粘贴头像，progress(done, total) 在每张头像粘贴后调用"""
+    total = len(plan.slots)
+    for done, ((x, y), tile) in enumerate(zip(plan.slots, tiles), 1):
+        # 带圆角的头像使用自身的 alpha 通道作为 mask
+        canvas.paste(tile, (x, y), tile if tile.mode == 'RGBA' else None)
+        if progress:
+            progress(done, total)
+
+
+def paste_names(canvas, plan, avatars, name_font, color, scale=1.0):
+    """在每张照片下方粘贴姓名（color 为 255 时可绘制到 L 模式的遮罩上）"""
+    line_spacing = scale_length(5, scale)  # 姓名行间距
+    name_padding = scale_length(10, scale)  # 姓名左右共留出的边距
+    max_width = plan.tile_size[0] - name_padding
+
+    for name_box, (filename, _) in zip(plan.name_boxes, avatars):
+        try:
+            name = os.path.splitext(filename)[0]
+
+            # 姓名标签按照片宽度换行（留出左右各5像素边距），
+            # 并缓存栅格化结果，颜色在合成时应用
+            label = label_cache.get(name, name_font, max_width, line_spacing)
+
+            # 文字从姓名区域顶部开始，水平居中
+            label.paste_to(canvas, (name_box[0] + name_box[2]) / 2, name_box[1], color)
+
+        except Exception as e:
+            logging.error(f"处理照片 {filename} 时出错: {e}")
+            continue
+
+
+def draw_title(canvas, plan, class_name, class_font, align, color):
+    """在标题区域内按对齐方式绘制标题，下对齐参考线"""
+    draw = ImageDraw.Draw(canvas)
+    text_width = draw.textlength(class_name, font=class_font)
+    left, text_y, right, _ = plan.title_box
+
+    if align == "居中":
+        text_x = left + (right - left - text_width) // 2
+    elif align == "右对齐":
+        text_x = right - text_width
+    else:
+        text_x = left
+
+    draw.text((text_x, text_y), class_name, font=class_font, fill=color)
+
+
+def get_class_fonts(fonts, settings, scale=1.0):
+    """按比例加载姓名和标题字体"""
+    name_font = load_font(*fonts['name'], scale_length(int(settings['avatar']['name_size']), scale))
+    class_font = load_font(*fonts['title'], scale_length(int(settings['title']['size']), scale))
+    return name_font, class_font
+
+
+def render_class(background, class_path, class_name, settings, fonts, avatar_workers=1, tile_cache=None,
+                 plan=None, avatar_range=None, scale=1.0, progress=None, cancel=None):
+    """在背景上排版单个班级（scale < 1 时为预览尺寸），返回使用的排版方案"""
+    try:
+        avatars = get_class_avatars(class_path, avatar_range)
+
+        if not avatars:
+            logging.warning(f"文件夹 {class_name} 中没有找到头像文件")
+            return None
+
+        logging.info(f"开始处理标题: {class_name}")
+        logging.info(f"找到 {len(avatars)} 个头像文件")
+
+        # 先取得排版方案（人数和参数相同时复用缓存），再按方案绘制
+        if plan is None or plan.total_avatars != len(avatars):
+            plan = plan_cache.get(len(avatars), layout_params(settings))
+        if len(avatars) > len(plan.slots):
+            raise ValueError(f"排版方案只有 {len(plan.slots)} 个位置，放不下 {len(avatars)} 张头像")
+        scaled_plan = plan.scaled(scale)
+        name_font, class_font = get_class_fonts(fonts, settings, scale)
+
+        # 解码和缩放在线程池中重叠进行，粘贴和绘制文字按位置顺序
+        tiles = load_tiles(scaled_plan, avatars, get_avatar_style(settings, scale), tile_cache, avatar_workers,
+                           cancel)
+        paste_tiles(background, scaled_plan, tiles, progress)
+        paste_names(background, scaled_plan, avatars, name_font, settings['avatar']['name_color'], scale)
+
+        title_settings = settings['title']
+        draw_title(background, scaled_plan, class_name, class_font, title_settings['align'],
+                   title_settings['color'])
+
+        cache_info = font_cache_info()
+        logging.info(f"标题 {class_name} 处理完成（字体缓存命中 {cache_info.hits} 次，未命中 {cache_info.misses} 次；"
+                     f"姓名标签缓存命中 {label_cache.hits} 次，未命中 {label_cache.misses} 次）")
+        return plan
+
+    except RenderCancelled:
+        raise
+    except Exception as e:
+        logging.error(f"处理标题 {class_name} 时出错: {e}")
+        raise
+
+
+# 批量渲染的进度事件队列和取消标志，由 run_batch 设置（进程池中通过 initializer 传入每个工作进程）
+_batch_state = {'events': None, 'cancel': None}
+
+
+def init_batch_worker(events, cancel):
+    """进程池初始化函数：记录进度事件队列和取消标志"""
+    _batch_state['events'] = events
+    _batch_state['cancel'] = cancel
+
+
+def render_class_job(job):
+    """进程池工作函数：渲染并保存一张画布，返回 (sheet_name, output_path, error, stats)"""
+    class_name = job['class_name']
+    sheet_name = job.get('sheet_name', class_name)
+    events, cancel = _batch_state['events'], _batch_state['cancel']
+
+    def emit(*event):
+        if events is not None:
+            events.put(event)
+
+    tile_cache = get_tile_cache(job['tile_cache_dir']) if job.get('tile_cache_dir') else None
+    hits, misses = (tile_cache.hits, tile_cache.misses) if tile_cache else (0, 0)
+    try:
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        if job.get('plan_error'):
+            raise ValueError(job['plan_error'])
+        emit('class_started', sheet_name, len(job['plan'].slots) if job.get('plan') else 0)
+        background = open_background(job['background_path'])
+        render_class(background, job['class_path'], class_name, job['settings'], job['fonts'],
+                     job.get('avatar_workers', 1), tile_cache, job.get('plan'), job.get('avatar_range'),
+                     progress=lambda done, total: emit('avatar_done', sheet_name, done, total), cancel=cancel)
+        save_atomic(background, job['output_path'], quality=95)
+        emit('encode_done', sheet_name, job['output_path'])
+        output_path, error = job['output_path'], None
+    except RenderCancelled:
+        output_path, error = None, BATCH_CANCELLED
+    except Exception as e:
+        output_path, error = None, str(e)
+
+    stats = {'tile_hits': 0, 'tile_misses': 0}
+    if tile_cache:
+        stats = {'tile_hits': tile_cache.hits - hits, 'tile_misses': tile_cache.misses - misses}
+    return sheet_name, output_path, error, stats
+
+
+def list_class_folders(avatars_folder):
+    """列出头像主文件夹下的所有标题文件夹（按名称排序）"""
+    return sorted(f for f in os.listdir(avatars_folder)
+                  if os.path.isdir(os.path.join(avatars_folder, f))
+                  and f != "排版结果")
+
+
+def default_output_folder(avatars_folder):
+    """默认输出文件夹：头像主文件夹上一级目录中的“排版完成”"""
+    return os.path.join(os.path.dirname(os.path.abspath(avatars_folder)), "排版完成")
+
+
+def split_class(class_name, class_path, params, min_tile_width=0):
+    """规划班级的各张画布，返回 [(sheet_name, avatar_range, plan), ...]（放得下时只有一张）"""
+    total = len(list_avatars(class_path))
+    if not total:
+        return [(class_name, None, None)]
+
+    sizes = plan_sheets(total, params, min_tile_width)
+    if len(sizes) == 1:
+        return [(class_name, None, plan_cache.get(total, params))]
+
+    sheets = []
+    start = 0
+    for i, size in enumerate(sizes, 1):
+        sheets.append((f"{class_name}_{i}", (start, start + size), plan_cache.get(size, params)))
+        start += size
+    return sheets
+
+
+def make_jobs(background_path, avatars_folder, output_folder, settings, fonts,
+              avatar_workers=1, tile_cache_dir=None):
+    """为每张画布生成一个 render_class_job 任务，排版方案随任务传给工作进程"""
+    params = layout_params(settings)
+    min_tile_width = get_min_tile_width(settings)
+    jobs = []
+    for class_folder in list_class_folders(avatars_folder):
+        class_path = os.path.join(avatars_folder, class_folder)
+        job = {
+            'background_path': background_path,
+            'class_path': class_path,
+            'class_name': class_folder,
+            'settings': settings,
+            'fonts': fonts,
+            'avatar_workers': avatar_workers,
+            'tile_cache_dir': tile_cache_dir
+        }
+        try:
+            sheets = split_class(class_folder, class_path, params, min_tile_width)
+        except (OSError, ValueError) as e:
+            # 规划错误由任务报告，与渲染错误一起汇总
+            sheets = [(class_folder, None, None)]
+            job['plan_error'] = str(e)
+
+        for sheet_name, avatar_range, plan in sheets:
+            jobs.append(dict(job,
+                             sheet_name=sheet_name,
+                             # 使用班级文件夹名（分页时加序号）作为文件名
+                             output_path=os.path.join(output_folder, f"{sheet_name}.jpg"),
+                             avatar_range=avatar_range,
+                             plan=plan))
+    return jobs
+
+
+def run_batch(jobs, workers=None, on_result=None, poll=None, poll_interval=0.1, events=None, cancel=None,
+              journal=None):
+    """在进程池中并行渲染多张画布，返回 (errors, stats)"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    errors = []
+    stats = {'tile_hits': 0, 'tile_misses': 0}
+    jobs_by_sheet = {job.get('sheet_name', job['class_name']): job for job in jobs}
+
+    def handle(result):
+        class_name, output_path, error, class_stats = result
+        for key, value in class_stats.items():
+            stats[key] += value
+        if error:
+            errors.append((class_name, error))
+        elif journal is not None:
+            journal.record(jobs_by_sheet[class_name], output_path)
+        if on_result:
+            on_result(class_name, output_path, error)
+
+    # 单进程时直接在当前进程中依次渲染
+    if workers <= 1 or len(jobs) <= 1:
+        init_batch_worker(events, cancel)
+        try:
+            for job in jobs:
+                handle(render_class_job(job))
+                if poll:
+                    poll()
+        finally:
+            init_batch_worker(None, None)
+        return errors, stats
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs), MAX_BATCH_WORKERS),
+                             initializer=init_batch_worker, initargs=(events, cancel)) as executor:
+        futures = {executor.submit(render_class_job, job): job for job in jobs}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                handle(future.result())
+            if cancel is not None and cancel.is_set():
+                # 取消尚未开始的任务，正在渲染的任务会自行停止
+                for future in [future for future in pending if future.cancel()]:
+                    pending.discard(future)
+                    job = futures[future]
+                    handle((job.get('sheet_name', job['class_name']), None, BATCH_CANCELLED,
+                            {'tile_hits': 0, 'tile_misses': 0}))
+            if poll:
+                poll()
+    return errors, stats
@@ -1,6 +1,9 @@
+import multiprocessing
 from image_arranger import ImageArranger
 
 if __name__ == "__main__":
+    # 批量渲染使用进程池，打包为 exe 时需要
+    multiprocessing.freeze_support()
     try:
         app = ImageArranger()
         app.run()
@@ -0,0 +1,99 @@
+"""排版规划测试：避让行与居中布局的每行照片数
+
+用法: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from layout_planner import (calculate_centered_layout, get_avoid_rows, plan_avoidance, plan_layout,
+                            solve_tile_size)
+
+PARAMS = {
+    'ratio': '4:5',
+    'layout_type': '居中布局',
+    'avoid_area': '中部',
+    'avoid_count': 2,
+    'top_margin': 270,
+    'bottom_margin': 650,
+    'side_margin': 130,
+    'name_size': 40,
+    'title_size': 120,
+    'title_bottom_margin': 200,
+}
+
+NO_AVOID = dict(PARAMS, avoid_area='无', avoid_count=0)
+
+
+class AvoidRowTest(unittest.TestCase):
+    def test_middle_rows(self):
+        # 行数为偶数时避让区域位于中间两行之间，为奇数时对准中间一行
+        self.assertEqual(get_avoid_rows(PARAMS, 4), (1, 2))
+        self.assertEqual(get_avoid_rows(PARAMS, 6), (2, 3))
+        self.assertEqual(get_avoid_rows(PARAMS, 5), (2, 2))
+
+    def test_bottom_row(self):
+        params = dict(PARAMS, avoid_area='下部')
+        self.assertEqual(get_avoid_rows(params, 4), (3, 3))
+        self.assertEqual(get_avoid_rows(params, 6), (5, 5))
+
+    def test_no_avoid(self):
+        self.assertIsNone(get_avoid_rows(NO_AVOID, 4))
+
+    def test_middle_rows_are_avoided(self):
+        for total, rows, avoided in ((45, 4, {1, 2}), (100, 6, {2, 3})):
+            self.assertEqual(solve_tile_size(total, PARAMS)[0], rows)
+            photo_width = solve_tile_size(total, PARAMS)[1]
+            self.assertEqual(plan_avoidance(PARAMS, rows, photo_width)[2], avoided)
+
+
+class CenteredLayoutTest(unittest.TestCase):
+    def test_four_rows(self):
+        self.assertEqual(calculate_centered_layout(44, 50, 4), [11, 11, 11, 11])
+        self.assertEqual(calculate_centered_layout(45, 50, 4), [11, 11, 11, 12])
+        self.assertEqual(calculate_centered_layout(46, 50, 4), [12, 11, 11, 12])
+        self.assertEqual(calculate_centered_layout(47, 50, 4), [12, 11, 12, 12])
+
+    def test_six_rows(self):
+        self.assertEqual(calculate_centered_layout(97, 50, 6), [16, 16, 16, 16, 16, 17])
+        self.assertEqual(calculate_centered_layout(98, 50, 6), [17, 16, 16, 16, 16, 17])
+        self.assertEqual(calculate_centered_layout(101, 50, 6), [17, 17, 16, 17, 17, 17])
+
+    def test_odd_rows_stay_symmetric(self):
+        self.assertEqual(calculate_centered_layout(41, 50, 3), [14, 13, 14])
+        self.assertEqual(calculate_centered_layout(43, 50, 5), [9, 8, 9, 8, 9])
+
+    def test_plan_row_counts(self):
+        self.assertEqual(plan_layout(45, NO_AVOID).row_counts, [11, 11, 11, 12])
+        self.assertEqual(plan_layout(100, NO_AVOID).row_counts, [17, 17, 16, 16, 17, 17])
+
+
+class AvoidLayoutTest(unittest.TestCase):
+    def assert_avoids(self, plan, total):
+        self.assertEqual(len(plan.slots), total)
+        width = plan.tile_size[0]
+        left, top, right, bottom = plan.avoid_box
+        for (x, y), name_box in zip(plan.slots, plan.name_boxes):
+            overlaps = x < right and x + width > left and y < bottom and name_box[3] > top
+            self.assertFalse(overlaps, (x, y))
+
+    def test_even_rows_symmetric(self):
+        # 避让的中间两行放同样多的照片，多出的照片从首尾两行轮流分配
+        for total, rows in ((45, 4), (100, 6)):
+            plan = plan_layout(total, PARAMS)
+            self.assertEqual(len(plan.row_counts), rows)
+            self.assert_avoids(plan, total)
+            middle = rows // 2
+            self.assertEqual(plan.row_counts[middle - 1], plan.row_counts[middle])
+            self.assertLessEqual(abs(plan.row_counts[0] - plan.row_counts[-1]), 1)
+
+    def test_left_aligned(self):
+        params = dict(PARAMS, layout_type='左对齐布局')
+        for total in (12, 45, 100, 150):
+            self.assert_avoids(plan_layout(total, params), total)
+
+
+if __name__ == '__main__':
+    unittest.main()
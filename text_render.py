@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+
+# 缓存的姓名标签数量上限
+LABEL_CACHE_SIZE = 4096
+
+
+# 不能出现在行首的标点（如少数民族姓名中的间隔号），与前一个字符放在同一行
+NO_LINE_START = set('·・‧•，。、；：！？）》」』】〕,.;:!?)]}')
+
+
+def is_cjk(ch):
+    """判断字符是否为可逐字断行的中日韩字符"""
+    code = ord(ch)
+    return (0x4E00 <= code <= 0x9FFF        # 中日韩统一表意文字
+            or 0x3400 <= code <= 0x4DBF     # 扩展 A
+            or 0xF900 <= code <= 0xFAFF     # 兼容表意文字
+            or 0x3000 <= code <= 0x30FF     # 中日韩标点、假名
+            or 0xAC00 <= code <= 0xD7AF     # 韩文音节
+            or 0xFF00 <= code <= 0xFFEF)    # 全角字符
+
+
+class TextMeasurer:
+    """按字体缓存每个字符的宽度，文本宽度由缓存的宽度累加得到"""
+
+    def __init__(self, font):
+        self.font = font
+        self.advances = {}
+
+    def width(self, text):
+        advances = self.advances
+        total = 0
+        for ch in text:
+            advance = advances.get(ch)
+            if advance is None:
+                advance = advances[ch] = self.font.getlength(ch)
+            total += advance
+        return total
+
+
+_measurers = {}
+_measurers_lock = threading.Lock()
+
+
+def get_measurer(font):
+    """获取字体对应的宽度测量器，按 (path, face_index, size) 共享（线程安全）"""
+    key = (font.path, font.index, font.size)
+    with _measurers_lock:
+        measurer = _measurers.get(key)
+        if measurer is None:
+            measurer = _measurers[key] = TextMeasurer(font)
+        return measurer
+
+
+def split_break_units(text):
+    """将文本切分为不可再分的断行单元
+
+    中日韩字符逐字成为单元，其他文字按单词切分（空格附在单词后），
+    行首禁则标点附在前一个单元后。
+    """
+    units = []
+    word = ''
+    for ch in text:
+        if ch in NO_LINE_START and not word and units:
+            units[-1] += ch
+        elif is_cjk(ch):
+            if word:
+                units.append(word)
+                word = ''
+            units.append(ch)
+        else:
+            word += ch
+            if ch == ' ':
+                units.append(word)
+                word = ''
+    if word:
+        units.append(word)
+    return units
+
+
+def wrap_text(text, font, max_width):
+    """处理文本换行，中日韩文字可逐字断行，英文按单词断行并保留空格
+
+    先按贪心算法求出所需行数，再在该行数下寻找最均衡的断行位置，
+    避免出现"三个字 + 一个字"这样的排法。
+    """
+    measurer = get_measurer(font)
+
+    # 如果文本宽度小于最大宽度，直接返回
+    if measurer.width(text) <= max_width:
+        return [text]
+
+    units = split_break_units(text)
+    widths = [measurer.width(unit) for unit in units]
+    trimmed = [measurer.width(unit.rstrip(' ')) for unit in units]
+
+    def layout(limit):
+        lines = []
+        start = 0
+        width = 0
+        for i in range(len(units)):
+            # 行尾空格不计入宽度；单个单元超宽时单独成行
+            if i > start and width + trimmed[i] > limit:
+                lines.append((start, i))
+                start = i
+                width = 0
+            width += widths[i]
+        lines.append((start, len(units)))
+        return lines
+
+    lines = layout(max_width)
+
+    # 在不增加行数的前提下缩小行宽上限，使各行长度尽量均衡
+    if len(lines) > 1:
+        low, high = min(max(trimmed), max_width), max_width
+        for _ in range(12):
+            mid = (low + high) / 2
+            candidate = layout(mid)
+            if len(candidate) <= len(lines):
+                lines, high = candidate, mid
+            else:
+                low = mid
+
+    return [''.join(units[start:end]).rstrip(' ') for start, end in lines]
+
+
+class NameLabel:
+    """预渲染的姓名标签：L 模式透明度图，每行在标签宽度内水平居中"""
+
+    def __init__(self, mask, width, offset_x):
+        self.mask = mask          # 文字透明度图
+        self.width = width        # 排版宽度（最长一行的宽度）
+        self.offset_x = offset_x  # 字形超出排版框左侧的像素数
+
+    def paste_to(self, canvas, center_x, top, color):
+        """以 center_x 为中心、top 为顶部，用指定颜色合成到画布上"""
+        x = int(center_x - self.width / 2) - self.offset_x
+        canvas.paste(color, (x, int(top)), self.mask)
+
+
+class LabelCache:
+    """姓名标签缓存
+
+    按 (text, font, size, max_width, line_spacing) 缓存换行和栅格化的结果，
+    颜色在合成时再应用，因此调整颜色或边距后不必重新排版文字。
+    预览线程和头像线程池可能同时使用，查找和淘汰都在锁内进行，渲染在锁外进行。
+    """
+
+    def __init__(self, maxsize=LABEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.labels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, text, font, max_width, line_spacing):
+        """获取姓名标签，没有缓存时渲染"""
+        key = (text, font.path, font.index, font.size, max_width, line_spacing)
+        with self.lock:
+            label = self.labels.get(key)
+            if label is not None:
+                self.labels.move_to_end(key)
+                self.hits += 1
+                return label
+            self.misses += 1
+
+        label = self.render(text, font, max_width, line_spacing)
+        with self.lock:
+            self.labels[key] = label
+            if len(self.labels) > self.maxsize:
+                self.labels.popitem(last=False)
+        return label
+
+    def render(self, text, font, max_width, line_spacing):
+        """换行并栅格化姓名"""
+        lines = wrap_text(text, font, max_width)
+        line_height = font.size + line_spacing
+        widths = [font.getlength(line) for line in lines]
+        width = max(widths)
+
+        # 计算所有字形的实际范围，避免超出排版框的部分被裁掉
+        positions = [((width - w) / 2, i * line_height) for i, w in enumerate(widths)]
+        boxes = [font.getbbox(line) for line in lines]
+        left = min(min(x + box[0] for (x, _), box in zip(positions, boxes)), 0)
+        right = max(max(x + box[2] for (x, _), box in zip(positions, boxes)), width)
+        bottom = max(y + box[3] for (_, y), box in zip(positions, boxes))
+        offset_x = int(-left) + 1
+
+        mask = Image.new('L', (int(right) + offset_x + 1, max(int(bottom) + 1, 1)), 0)
+        draw = ImageDraw.Draw(mask)
+        for line, (x, y) in zip(lines, positions):
+            draw.text((x + offset_x, y), line, font=font, fill=255)
+
+        return NameLabel(mask, width, offset_x)
+
+    def clear(self):
+        with self.lock:
+            self.labels.clear()
+
+
+# 全局姓名标签缓存，在多次预览和生成之间共享
+label_cache = LabelCache()
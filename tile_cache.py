@@ -0,0 +1,116 @@
+import os
+import hashlib
+import threading
+from PIL import Image
+from atomic_save import save_atomic
+
+# 缓存格式版本，头像处理流程变化导致结果不同时递增
+TILE_CACHE_VERSION = 3
+
+# 缓存目录的总大小上限（字节）
+TILE_CACHE_MAX_BYTES = 1 << 30
+
+
+def user_cache_dir():
+    """当前用户的缓存目录：Windows 为 %LOCALAPPDATA%，其他系统为 $XDG_CACHE_HOME（默认 ~/.cache）"""
+    # 程序安装目录通常不可写，源码目录也不应被缓存文件填满
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'AvatarLayoutTool')
+
+
+DEFAULT_TILE_CACHE_DIR = os.path.join(user_cache_dir(), 'tile_cache')
+
+
+class TileCache:
+    """处理好的头像磁盘缓存
+
+    按源文件路径、修改时间、大小以及头像尺寸和样式（比例、圆角、边框）寻址，
+    保存可直接粘贴的头像（有圆角时为 RGBA，否则为 RGB）。命中时只需读取一次源文件的状态，不必重新解码。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_TILE_CACHE_DIR, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # 保护命中计数，头像线程池会同时查询
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, source_path, size, style):
+        """根据源文件状态和渲染参数计算缓存文件路径"""
+        stat = os.stat(source_path)
+        key = repr((TILE_CACHE_VERSION, os.path.abspath(source_path), stat.st_mtime_ns,
+                    stat.st_size, tuple(size), tuple(style)))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.png')
+
+    def get(self, source_path, size, style):
+        """读取缓存的头像，没有缓存时返回 None"""
+        try:
+            path = self._path(source_path, size, style)
+            with Image.open(path) as tile:
+                tile.load()
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # 更新修改时间作为最近使用时间，供淘汰时参考
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return tile
+
+    def put(self, source_path, size, style, tile):
+        """保存头像（原子替换，并发进程不会读到半个文件），写入失败时忽略"""
+        path = self._path(source_path, size, style)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_atomic(tile, path, compress_level=1)
+        except OSError:
+            pass
+
+    def trim(self):
+        """按最近使用时间淘汰旧文件，直到总大小不超过上限，返回删除的文件数"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+_tile_caches = {}
+
+
+def get_tile_cache(cache_dir=DEFAULT_TILE_CACHE_DIR):
+    """获取当前进程中指定目录的头像缓存（同一目录共享一个实例）"""
+    cache = _tile_caches.get(cache_dir)
+    if cache is None:
+        cache = _tile_caches[cache_dir] = TileCache(cache_dir)
+    return cache